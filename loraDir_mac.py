@@ -1,4 +1,4 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
  LoRaSimMac v1.0: extension of LoRaSim
@@ -47,6 +47,9 @@
    		- this is useful when you want to know how many retries are currently performed
 """
 
+from __future__ import print_function
+from __future__ import division
+
 """
  LoRaSim 0.2.1: simulate collisions in LoRa
  Copyright © 2016 Thiemo Voigt <thiemo@sics.se> and Martin Bor <m.bor@lancaster.ac.uk>
@@ -109,9 +112,14 @@ import random
 import numpy as np
 import math
 import sys
-import matplotlib.pyplot as plt
 import os
 
+#python 2 StringIO accepts the str written by print
+try:
+	from StringIO import StringIO
+except ImportError:
+	from io import StringIO
+
 #proposed channel access mechanism
 #WL=7 W2=10 W3=7 Wnav=0 W2afterNAV=7, carrier sense & exponential backoff can be enabled
 #python loraDir_mac.py 1 20 20000 4 600000000 1 7 10 7 0 7
@@ -127,6 +135,7 @@ BASIC USAGE EXAMPLE:
 - set distribType to either expoDistribType or uniformDistribType
 - set packetLength to the packet length you want to simulate
 - set print_sim = False to disable output on terminal to get faster execution
+	- or keep print_sim = False and add --verbose on the command line to get the trace for a single run
 - then:
 
 	> python loraDir_mac.py 1 20 20000 4 600000000 1 7 10 7 0 7
@@ -145,6 +154,11 @@ BASIC USAGE EXAMPLE:
 	> python loraDir_mac.py 1 20 20000 4 600000000 1 7 10 7 0 7
 		+--------------------------^
 
+- each run is a single process, a sweep can use all the cores by running several simulations at the same time
+	the summary of a run is appended to expX.dat in a single write so parallel runs do not mix their results
+
+	> printf "%s\n" 5000 10000 20000 40000 | xargs -P 4 -I{} python loraDir_mac.py 1 20 {} 4 600000000 1 7 10 7 0 7
+
 ADVANCED USAGE EXAMPLE:
 
 - change the common channel access parameters and the collision avoidance parameters under sections
@@ -181,6 +195,8 @@ check_busy = True
 
 #turn on/off print
 #disabling printing to stdout will make simulation much faster
+#every trace print of the simulation is inside an if print_sim: block so that no message is formatted when it is False
+#only the fatal errors and the progress display on stderr are printed unconditionally
 print_sim = False
 stdout_print_target=sys.stdout
 
@@ -236,16 +252,24 @@ n_retry=40
 #maximum number of retry for RTS
 n_retry_rts=20
 
+#zero-filled retry histograms, each node gets its own copy
+retry_bin_template=np.zeros(n_retry, dtype=np.int64)
+retry_rts_bin_template=np.zeros(n_retry_rts+1, dtype=np.int64)
+
 #CCA reliability probability
 #set to 0 to always assume that CCA indicates a free channel so that CA will be always used, or transmit immediately in ALOHA
 #set to 100 for a fully reliable CCA, normally there should not be collision at all
 #set to [1,99] to indicate a reliability percentage: i.e. (100-CCA_prob) is the probability that CCA reports a free channel while channel is busy
 CCA_prob=50
+#probability that CCA detects a busy channel, compared with random.random()
+CCA_busy_prob=CCA_prob/100.0
 
-#indicate whether channel is busy or not, we differentiate between channel_busy_rts and channel_busy_data
-#to get more detailed statistics
-channel_busy_rts = False
-channel_busy_data = False
+#indicate whether channel is busy or not, we differentiate between an RTS and a DATA transmission
+#to get more detailed statistics: bit channel_busy_rts is set during an RTS and bit channel_busy_data during a DATA
+#so that channel_busy!=0 when the channel is busy
+channel_busy_rts = 1
+channel_busy_data = 2
+channel_busy = 0
 
 #minimun backoff when channel has been detected busy
 Wbusy_min=1
@@ -259,6 +283,11 @@ Wbusy_add_max_toa=False
 #exponential backoff
 Wbusy_exp_backoff=True
 
+#2**BE for the backoff exponents, node.Wbusy_BE never goes above the larger of Wbusy_BE and Wbusy_maxBE
+Wbusy_pow2=tuple(1 << be for be in range(max(Wbusy_BE,Wbusy_maxBE)+1))
+#exponent to use after a busy backoff: incremented up to Wbusy_maxBE with exponential backoff, unchanged otherwise
+Wbusy_next_BE=tuple(be+1 if Wbusy_exp_backoff and be<Wbusy_maxBE else be for be in range(len(Wbusy_pow2)))
+
 ##############
 #only for CA #
 ##############
@@ -314,7 +343,9 @@ cad_consumption = [2.84, 5.75, 20.44, 41.36, 134.55, 169.54]
 #end CA      #
 ##############
 
-lastDisplayTime=-1
+#the progress display on stderr shows nrProcessed each time it reaches nextProgressMark
+progressStep=10000
+nextProgressMark=0
 
 ################################
 # stats on inter-transmit time #
@@ -323,10 +354,17 @@ lastDisplayTime=-1
 n_transmit = 0
 inter_transmit_time = 0
 max_inter_transmit_time = 40
-inter_transmit_time_bin=[]
-
-for i in range(max_inter_transmit_time+1):
-	inter_transmit_time_bin.append(0)	
+inter_transmit_time_bin=np.zeros(max_inter_transmit_time+1, dtype=np.int64)
+#inter-transmit times not yet put in inter_transmit_time_bin, they are binned by batch of inter_transmit_time_flush
+inter_transmit_time_samples = []
+inter_transmit_time_flush = 4096
+
+#put the pending samples in bin from 0s to max_inter_transmit_time in second
+def flush_inter_transmit_time():
+	if inter_transmit_time_samples:
+		secs = (np.array(inter_transmit_time_samples)/1000).astype(np.int64)
+		inter_transmit_time_bin[:] += np.bincount(np.minimum(secs, max_inter_transmit_time), minlength=max_inter_transmit_time+1)
+		del inter_transmit_time_samples[:]
 			
 last_transmit_time = 0
 
@@ -350,6 +388,8 @@ if lora24GHz:
 	sf10 = np.array([10,-124.0,-122.0,-120.0,-114.0])
 	sf11 = np.array([11,-127.0,-125.0,-123.0,-117.0])
 	sf12 = np.array([12,-130.0,-128.0,-126.0,-120.0])
+	# one row per sf, built once as a single 2D array
+	sensi = np.array([sf5,sf6,sf7,sf8,sf9,sf10,sf11,sf12])
 else:
 	#taken for spec
 	sf6 = np.array([6,-118.0,-115.0,-111.0])
@@ -361,58 +401,119 @@ else:
 	sf10 = np.array([10,-132.75,-130.25,-128.75])
 	sf11 = np.array([11,-134.5,-132.75,-128.75])
 	sf12 = np.array([12,-133.25,-132.25,-132.25])
+	# one row per sf, built once as a single 2D array
+	sensi = np.array([sf6,sf7,sf8,sf9,sf10,sf11,sf12])
+
+#
+# batched random draws
+# numpy draws size values in one call which is much cheaper than one random.randint()/random.choice() per value
+# use np.random.seed() to get reproducible node placement and radio settings
+def int_pool(lo,hi,size=4096):
+	while True:
+		for v in np.random.randint(lo,hi+1,size=size):
+			yield int(v)
+
+def choice_pool(choices,size=4096):
+	while True:
+		for i in np.random.randint(0,len(choices),size=size):
+			yield choices[i]
+
+def uniform_pool(size=4096):
+	while True:
+		for v in np.random.random_sample(size):
+			yield float(v)
+
+#bandwidths (in the order of the sensi columns) and channel frequencies
+bw_choices = (125, 250, 500)
+bw_choices_24 = (203.125, 406.250, 812.5, 1625)
+freq_choices = (860000000, 864000000, 868000000)
+freq_choices_24 = (2403000000, 2425000000, 2479000000)
+
+if lora24GHz:
+	sf_pool = int_pool(5,12)
+	bw_pool = choice_pool(bw_choices_24)
+	freq_pool = choice_pool(freq_choices_24)
+else:
+	sf_pool = int_pool(6,12)
+	bw_pool = choice_pool(bw_choices)
+	freq_pool = choice_pool(freq_choices)
+cr_pool = int_pool(1,4)
+freq_offset_pool = int_pool(0,2622950)
+position_pool = uniform_pool()
+
+#
+# add/remove a node's packet to/from the packets being received at the base station
+# packetsAtBS keeps all of them in arrival order, packetsAtBS_by_sf only the ones with a given sf
+# packetsAtBS_set has the same nodes than packetsAtBS and is used for the membership tests
+# packetsAtBS_processed counts the ones with packet.processed==1, which does not change while a packet is at the base station
+def addPacketAtBS(node):
+	global packetsAtBS_processed
+	packetsAtBS.append(node)
+	packetsAtBS_set.add(node)
+	packetsAtBS_by_sf.setdefault(node.packet.sf, []).append(node)
+	if node.packet.processed == 1:
+		packetsAtBS_processed = packetsAtBS_processed + 1
+
+def removePacketAtBS(node):
+	global packetsAtBS_processed
+	packetsAtBS.remove(node)
+	packetsAtBS_set.discard(node)
+	packetsAtBS_by_sf[node.packet.sf].remove(node)
+	if node.packet.processed == 1:
+		packetsAtBS_processed = packetsAtBS_processed - 1
 
 #
 # check for collisions at base station
 # Note: called before a packet (or rather node) is inserted into the list
 def checkcollision(packet):
 	col = 0 # flag needed since there might be several collisions for packet
-	processing = 0
-	for i in range(0,len(packetsAtBS)):
-		if packetsAtBS[i].packet.processed == 1 :
-			processing = processing + 1
-	if (processing > maxBSReceives):
-		print "too long:", len(packetsAtBS)
+	#read once the values used several times below
+	now = env.now
+	nodeid = packet.nodeid
+	ptype = packet.ptype
+	if (packetsAtBS_processed > maxBSReceives):
+		if print_sim:
+			print("too long:", len(packetsAtBS))
 		packet.processed = 0
 	else:
 		packet.processed = 1
 
-	if packet.ptype == rtsPacketType:
-		type_str="RTS"
-	elif packet.ptype == dataPacketType:	
-		type_str="DATA"
-	else:
-		type_str="N/A"
-		
-	print "*****> RCV at GW from node {} {} (sf:{} bw:{} freq:{:.6e}) others: {}".format(packet.nodeid, type_str, packet.sf, packet.bw, packet.freq, len(packetsAtBS)) 
-
 	global CA	
-	
-	if CA:
-		print "- ",
-		nbNodeListening=0
-
-		for node in nodes:
-			if node.ca_state==start_phase1_listen or node.ca_state==start_phase2_listen:
-				if node.receive_rts==False and node.receive_data==False:
-					nbNodeListening = nbNodeListening + 1
-					print "{} - ".format(node.nodeid),
 
-		print ""		
-		print "There are {} nodes listening".format(nbNodeListening)
+	#all the printing below is only to trace the simulation, skip the formatting work when print_sim is False
+	if print_sim:
+		if packet.ptype == rtsPacketType:
+			type_str="RTS"
+		elif packet.ptype == dataPacketType:	
+			type_str="DATA"
+		else:
+			type_str="N/A"
+			
+		print("*****> RCV at GW from node %s %s (sf:%s bw:%s freq:%.6e) others: %s" % (packet.nodeid, type_str, packet.sf, packet.bw, packet.freq, len(packetsAtBS))) 
+	
+		if CA:
+			#nodes that are still listening, i.e. that have not received an RTS or DATA yet
+			listeners = [str(node.nodeid) for node in listening_nodes if not (node.receive_rts or node.receive_data)]
+			print("- " + "".join(nid + " - " for nid in listeners))
+			print("There are %s nodes listening" % len(listeners))
 	
 	if packetsAtBS:
-		print "************************************************************************"
-		print "CHECK node {} (sf:{} bw:{} freq:{:.6e}) others: {}".format(packet.nodeid, packet.sf, packet.bw, packet.freq, len(packetsAtBS))
-		for other in packetsAtBS:
-			if other.nodeid != packet.nodeid:
-				if other.packet.ptype == rtsPacketType:
-					type_str="RTS"
-				elif other.packet.ptype == dataPacketType:	
-					type_str="DATA"
-				else:
-					type_str="N/A"				
-				print ">> node {} {} (sf:{} bw:{} freq:{:.6e})".format(other.nodeid, type_str, other.packet.sf, other.packet.bw, other.packet.freq)
+		if print_sim:
+			print("************************************************************************")
+			print("CHECK node %s (sf:%s bw:%s freq:%.6e) others: %s" % (packet.nodeid, packet.sf, packet.bw, packet.freq, len(packetsAtBS)))
+		#only packets with the same sf can collide, see sfCollision
+		#the tests are not moved to a numba kernel over arrays of the packets at the base station: only a few packets
+		#are on air at the same time in the sf bucket, keeping parallel arrays in sync would cost more than the tests
+		for other in packetsAtBS_by_sf.get(packet.sf, ()):
+			if other.nodeid != nodeid:
+				if print_sim:
+					if other.packet.ptype == rtsPacketType:
+						type_str="RTS"
+					elif other.packet.ptype == dataPacketType:	
+						type_str="DATA"
+					else:
+						type_str="N/A"				
+					print(">> node %s %s (sf:%s bw:%s freq:%.6e)" % (other.nodeid, type_str, other.packet.sf, other.packet.bw, other.packet.freq))
 				# simple collision
 				if frequencyCollision(packet, other.packet) and sfCollision(packet, other.packet):
 					if full_collision:
@@ -433,71 +534,91 @@ def checkcollision(packet):
 						other.packet.collided = 1	 # other also got lost, if it wasn't lost already
 						col = 1			
 
-		print "Summary: ",
-		print "Packet from {}(".format(packet.nodeid),
-		if packet.collided:
-			print "collided) ",
-		else:
-			print "ok) ",
-		for other in packetsAtBS:
-			print "Packet from {}(".format(other.nodeid),
-			if other.packet.collided:
-				print "collided) ",
+		if print_sim:
+			print("Summary: ", end=' ')
+			print("Packet from %s(" % packet.nodeid, end=' ')
+			if packet.collided:
+				print("collided) ", end=' ')
 			else:
-				print "ok) ",			 		
+				print("ok) ", end=' ')
+			for other in packetsAtBS:
+				print("Packet from %s(" % other.nodeid, end=' ')
+				if other.packet.collided:
+					print("collided) ", end=' ')
+				else:
+					print("ok) ", end=' ')			 		
 
-		print ""
+			print("")
 		
 		if CA:
 			#we have to correct previous decision as previous RTS or DATA packets can be now marked as collided
 			#their state can still be listening, we just cancel the fact that they received an RTS or DATA
+			#receive_rts_by_sender and receive_data_by_sender give directly the nodes that received from other
 			for other in packetsAtBS:
-				for node in nodes:
-					if node.receive_rts==True and node.receive_rts_from==other.nodeid and other.packet.collided:
-						print "** node {} cancel reception of RTS from node {} due to collision".format(node.nodeid, other.nodeid)
-						node.receive_rts=False
-					if node.receive_data==True and node.receive_data_from==other.nodeid and other.packet.collided:
-						print "** node {} cancel reception of ValidHeader from node {} due to collision".format(node.nodeid, other.nodeid)					
-						node.receive_data=False
+				if other.packet.collided:
+					receivers=receive_rts_by_sender.get(other.nodeid)
+					if receivers:
+						for node in receivers:
+							if print_sim:
+								print("** node %s cancel reception of RTS from node %s due to collision" % (node.nodeid, other.nodeid))
+							node.receive_rts=False
+						receivers.clear()
+					receivers=receive_data_by_sender.get(other.nodeid)
+					if receivers:
+						for node in receivers:
+							if print_sim:
+								print("** node %s cancel reception of ValidHeader from node %s due to collision" % (node.nodeid, other.nodeid))					
+							node.receive_data=False
+						receivers.clear()
 		
-	print "========================================================================"	
+	if print_sim:
+		print("========================================================================")	
 	
 	#if col==1 it means that the new packet can not be decoded
 	if col:
 		return col	
 			
 	#normally, here, the packet has been correctly received	
-	print "GW got packet from node {}".format(packet.nodeid)
+	if print_sim:
+		print("GW got packet from node %s" % packet.nodeid)
 
 	if CA:
 		#the trick is to assume that if the gateway received a packet
 		#then all other nodes in the listening period should also have receive it
 		#there might be some cases where a geographically central gw would have received a packet while a distant node,
 		#far from the transmitter node might not receive the packet. But here we assume that the distances allow such reception
-		for node in nodes:
-			if node.nodeid != packet.nodeid:
-				if node.ca_state==start_phase1_listen or node.ca_state==start_phase2_listen:
-					#either we receive an RTS, either it is a DATA
-					#once we receive RTS or DATA we normally leave listen state to go into NAV
-					if node.receive_rts==False and node.receive_data==False:
-						if packet.ptype==rtsPacketType:
-							node.receive_rts=True
-							node.receive_rts_from=packet.nodeid
-							print "-- node {} marked to have received RTS from node {}".format(node.nodeid, packet.nodeid)
-							#keep track of when the RTS should have been received
-							node.receive_rts_time=env.now
-							#for an RTS packet, packet.data_len stores the data packet length
-							#set node.nav to the size of the forthcoming data packet
-							node.nav=packet.data_len
-						if packet.ptype==dataPacketType:
-							node.receive_data=True
-							node.receive_data_from=packet.nodeid
-							print "-- node {} marked to have received ValidHeader from node {}".format(node.nodeid, packet.nodeid)					
-							#keep track of when the DATA should have been received
-							node.receive_data_time=env.now
-							#for an DATA packet we take the maximum length
-							node.nav=max_payload_size						
-	print "========================================================================"
+		#listening_nodes contains the nodes in start_phase1_listen or start_phase2_listen
+		for node in listening_nodes:
+			if node.nodeid != nodeid:
+				#either we receive an RTS, either it is a DATA
+				#once we receive RTS or DATA we normally leave listen state to go into NAV
+				if node.receive_rts==False and node.receive_data==False:
+					if ptype==rtsPacketType:
+						node.receive_rts=True
+						node.receive_rts_from=nodeid
+						receive_rts_by_sender.setdefault(nodeid, set()).add(node)
+						if print_sim:
+							print("-- node %s marked to have received RTS from node %s" % (node.nodeid, nodeid))
+						#keep track of when the RTS should have been received
+						node.receive_rts_time=now
+						#for an RTS packet, packet.data_len stores the data packet length
+						#set node.nav to the size of the forthcoming data packet
+						node.nav=packet.data_len
+						#the nav period will use the time-on-air of node.nav bytes with the node's own radio settings
+						node.nav_airtime=airtime(node.packet.sf,node.packet.cr,node.nav,node.packet.bw)
+					if ptype==dataPacketType:
+						node.receive_data=True
+						node.receive_data_from=nodeid
+						receive_data_by_sender.setdefault(nodeid, set()).add(node)
+						if print_sim:
+							print("-- node %s marked to have received ValidHeader from node %s" % (node.nodeid, nodeid))					
+						#keep track of when the DATA should have been received
+						node.receive_data_time=now
+						#for an DATA packet we take the maximum length
+						node.nav=max_payload_size						
+						node.nav_airtime=node.packet.max_payload_rectime
+	if print_sim:
+		print("========================================================================")
 	return 0
 
 #
@@ -506,42 +627,47 @@ def checkcollision(packet):
 #		 |f1-f2| <= 120 kHz if f1 or f2 has bw 500
 #		 |f1-f2| <= 60 kHz if f1 or f2 has bw 250
 #		 |f1-f2| <= 30 kHz if f1 or f2 has bw 125
+#
+# the largest bw of the 2 packets gives the condition, so each packet keeps its own limit in freqGuard
 def frequencyCollision(p1,p2):
-	if (abs(p1.freq-p2.freq)<=120 and (p1.bw==500 or p2.freq==500)):
-		print "frequency coll 500"
-		return True
-	elif (abs(p1.freq-p2.freq)<=60 and (p1.bw==250 or p2.freq==250)):
-		print "frequency coll 250"
+	guard = max(p1.freqGuard, p2.freqGuard)
+	if abs(p1.freq-p2.freq) <= guard:
+		if print_sim:
+			#the trace gives the bandwidth the guard belongs to
+			print("frequency coll %s" % {120:500, 60:250}.get(guard, 125))
 		return True
-	else:
-		if (abs(p1.freq-p2.freq)<=30):
-			print "frequency coll 125"
-			return True
-		#else:
-	print "no frequency coll"
+	if print_sim:
+		print("no frequency coll")
 	return False
 
 def sfCollision(p1, p2):
 	if p1.sf == p2.sf:
-		print "collision sf node {} and node {}".format(p1.nodeid, p2.nodeid)
+		if print_sim:
+			print("collision sf node %s and node %s" % (p1.nodeid, p2.nodeid))
 		# p2 may have been lost too, will be marked by other checks
 		return True
-	print "no sf collision"
+	if print_sim:
+		print("no sf collision")
 	return False
 
 def powerCollision(p1, p2):
 	powerThreshold = 6 # dB
-	print "pwr: node {0.nodeid} {0.rssi:3.2f} dBm node {1.nodeid} {1.rssi:3.2f} dBm; diff {2:3.2f} dBm".format(p1, p2, round(p1.rssi - p2.rssi,2))
-	if abs(p1.rssi - p2.rssi) < powerThreshold:
-		print "collision pwr both node {} and node {}".format(p1.nodeid, p2.nodeid)
+	diff = p1.rssi - p2.rssi
+	if print_sim:
+		print("pwr: node %s %3.2f dBm node %s %3.2f dBm; diff %3.2f dBm" % (p1.nodeid, p1.rssi, p2.nodeid, p2.rssi, round(diff,2)))
+	if abs(diff) < powerThreshold:
+		if print_sim:
+			print("collision pwr both node %s and node %s" % (p1.nodeid, p2.nodeid))
 		# packets are too close to each other, both collide
 		# return both packets as casualties
 		return (p1, p2)
-	elif p1.rssi - p2.rssi < powerThreshold:
+	elif diff < powerThreshold:
 		# p2 overpowered p1, return p1 as casualty
-		print "collision pwr node {} overpowered node {}".format(p2.nodeid, p1.nodeid)
+		if print_sim:
+			print("collision pwr node %s overpowered node %s" % (p2.nodeid, p1.nodeid))
 		return (p1,)
-	print "p1 wins, p2 lost"
+	if print_sim:
+		print("p1 wins, p2 lost")
 	# p2 was the weaker packet, return it as a casualty
 	return (p2,)
 
@@ -550,71 +676,125 @@ def timingCollision(p1, p2):
 	# we've already determined that p1 is a weak packet, so the only
 	# way we can win is by being late enough (only the first n - 5 preamble symbols overlap)
 
-	# assuming 8 preamble symbols
-	Npream = 8
+	now = env.now
 
 	# we can lose at most (Npream - 5) * Tsym of our preamble
-	Tpreamb = 2**p1.sf/(1.0*p1.bw) * (Npream - 5)
+	# this is computed once per packet in p1.Tcritical
+	Tpreamb = p1.Tcritical
 
 	# check whether p2 ends in p1's critical section
-	p2_end = p2.addTime + p2.rectime
-	p1_cs = env.now + Tpreamb
-	print "collision timing node {} ({},{},{}) node {} ({},{})".format(
-		p1.nodeid, env.now - env.now, p1_cs - env.now, p1.rectime,
-		p2.nodeid, p2.addTime - env.now, p2_end - env.now
-	)
+	p2_end = p2.endTime
+	p1_cs = now + Tpreamb
+	if print_sim:
+		print("collision timing node %s (%s,%s,%s) node %s (%s,%s)" % (
+			p1.nodeid, now - now, p1_cs - now, p1.rectime,
+			p2.nodeid, p2.addTime - now, p2_end - now
+		))
 	if p1_cs < p2_end:
 		# p1 collided with p2 and lost
-		print "not late enough"
+		if print_sim:
+			print("not late enough")
 		return True
-	print "saved by the preamble"
+	if print_sim:
+		print("saved by the preamble")
 	return False
 
+#2**sf for sf in [0..12], avoids a float pow for each symbol time
+pow2_sf = tuple(float(1 << s) for s in range(13))
+
 # this function computes the airtime of a packet
 # according to LoraDesignGuide_STD.pdf
+# lora24GHz is given as the lora24 argument so that the function only works on numbers
 #
-def airtime(sf,cr,pl,bw):
+def airtime_kernel(sf,cr,pl,bw,lora24):
 	
 	DE = 0		 # low data rate optimization enabled (=1) or not (=0)
 	Npream = 8	 # number of preamble symbol (12.25	 from Utz paper)
 
-	if lora24GHz:
+	if lora24:
 		Npream = 12
 		H = 1		 # header for variable length packet (H=1) or not (H=0)		
 		if sf > 10:
 			# low data rate optimization mandated for SF > 10
 			DE = 1
-		Tsym = (2.0**sf)/bw
+		Tsym = pow2_sf[sf]/bw
 		if sf < 7:
 			Tpream = (Npream + 6.25)*Tsym
 		else:
 			Tpream = (Npream + 4.25)*Tsym
 		#print "sf", sf, " cr", cr, "pl", pl, "bw", bw
+		#pl, sf, H and DE are integers so the ceiling is computed with an integer division: ceil(a/b) = -(-a//b)
 		if sf >= 7:
-			payloadSymbNB = 8 + math.ceil(max((8.0*pl+16-4.0*sf+8+20*H),0)/(4.0*(sf-2*DE)))*(cr+4)
+			num = max(8*pl+16-4*sf+8+20*H, 0)
 		else:
-			payloadSymbNB = 8 + math.ceil(max((8.0*pl+16-4.0*sf+20*H),0)/(4.0*(sf-2*DE)))*(cr+4)
+			num = max(8*pl+16-4*sf+20*H, 0)
+		payloadSymbNB = 8 + (-(-num // (4*(sf-2*DE))))*(cr+4)
 		Tpayload = payloadSymbNB * Tsym
 		return Tpream + Tpayload		
 	else:
 		H = 0		 # implicit header disabled (H=0) or not (H=1)
-		if bw == 125 and sf in [11, 12]:
+		if bw == 125 and (sf == 11 or sf == 12):
 			# low data rate optimization mandated for BW125 with SF11 and SF12
 			DE = 1
 		if sf == 6:
 			# can only have implicit header with SF6
 			H = 1
-		Tsym = (2.0**sf)/bw
+		Tsym = pow2_sf[sf]/bw
 		Tpream = (Npream + 4.25)*Tsym
 		#print "sf", sf, " cr", cr, "pl", pl, "bw", bw
-		payloadSymbNB = 8 + max(math.ceil((8.0*pl-4.0*sf+28+16-20*H)/(4.0*(sf-2*DE)))*(cr+4),0)
+		#same integer ceiling as above
+		num = 8*pl-4*sf+28+16-20*H
+		payloadSymbNB = 8 + max((-(-num // (4*(sf-2*DE))))*(cr+4),0)
 		Tpayload = payloadSymbNB * Tsym
 		return Tpream + Tpayload
+
+#
+# airtime of all the (sfs[i],bws[j]) combinations
+def airtime_grid_kernel(sfs,bws,cr,pl,lora24):
+	grid = np.empty((sfs.shape[0], bws.shape[0]))
+	for i in range(sfs.shape[0]):
+		for j in range(bws.shape[0]):
+			grid[i,j] = airtime_kernel(sfs[i],cr,pl,bws[j],lora24)
+	return grid
+
+#sf, cr, pl and bw only take a small number of values during a simulation
+#so each airtime is computed once by the (compiled) kernel and then kept in airtime_cache
+airtime_cache = {}
+
+def airtime(sf,cr,pl,bw):
+	key = (sf,cr,pl,bw)
+	at = airtime_cache.get(key)
+	if at is None:
+		at = airtime_kernel(sf,cr,pl,bw,lora24GHz)
+		airtime_cache[key] = at
+	return at
+
+#airtimes with cr=1 of the settings searched by experiment 3 and 5, for a given packet length
+#row i is for sf=sensi[i,0], columns are for bw 125, 250 and 500
+airtime_grid_cache = {}
+
+def airtime_grid(pl):
+	grid = airtime_grid_cache.get(pl)
+	if grid is None:
+		grid = airtime_grid_kernel(sensi[0:6,0].astype(np.int64), np.array(bw_choices), 1, pl, lora24GHz)
+		airtime_grid_cache[pl] = grid
+	return grid
 	
 #
 # this function creates a node
 #
-class myNode():
+class myNode(object):
+	#fixed attribute layout, no per-instance __dict__ (cca_energy is set after the simulation)
+	__slots__ = ('nodeid', 'nodeType', 'period', 'distrib', 'bs', 'x', 'y', 'dist', 'packet', 'data_len',
+		'data_rectime', 'rts_rectime', 'n_data_sent', 'n_rts_sent', 'ca_state',
+		'want_transmit_time', 'ca_listen_start_time', 'ca_listen_end_time', 'total_listen_time',
+		'P', 'my_P', 'backoff', 'receive_rts', 'receive_rts_time', 'receive_rts_from',
+		'n_receive_nav_rts_p1', 'n_receive_nav_rts_p2', 'receive_data', 'receive_data_time',
+		'receive_data_from', 'n_receive_nav_data_p1', 'n_receive_nav_data_p2', 'nav', 'nav_airtime', 'cca',
+		'n_cca', 'n_busy_rts', 'n_busy_rts_p1', 'n_busy_data', 'n_retry', 'total_retry',
+		'retry_bin', 'n_retry_rts', 'total_retry_rts', 'retry_rts_bin', 'n_aborted', 'cycle',
+		'W2', 'latency', 'Wbusy_BE', 'cca_energy', 'tx_mA')
+
 	def __init__(self, nodeid, nodeType, bs, period, distrib, packetlen):
 		self.nodeid = nodeid
 		self.nodeType = nodeType		
@@ -633,43 +813,45 @@ class myNode():
 		# and ensure minimum distance between each pair of nodes
 		found = 0
 		rounds = 0
-		global nodes
+		global nodes_x
+		global nodes_y
 		while (found == 0 and rounds < 100):
-			a = random.random()
-			b = random.random()
+			a = next(position_pool)
+			b = next(position_pool)
 			if b<a:
 				a,b = b,a
 			posx = b*maxDist*math.cos(2*math.pi*a/b)+bsx
 			posy = b*maxDist*math.sin(2*math.pi*a/b)+bsy
-			if len(nodes) > 0:
-				for index, n in enumerate(nodes):
-					dist = np.sqrt(((abs(n.x-posx))**2)+((abs(n.y-posy))**2))
-					if dist >= 10:
-						found = 1
-						self.x = posx
-						self.y = posy
-					else:
-						rounds = rounds + 1
-						if rounds == 100:
-							print "could not place new node, giving up"
-							exit(-1)
+			#the new node must be at least 10m away from all the nodes already placed
+			#positions are kept in nodes_x/nodes_y so that all the distances are computed in a single numpy call
+			if nodes_x.size > 0 and np.hypot(nodes_x-posx, nodes_y-posy).min() < 10:
+				rounds = rounds + 1
+				if rounds == 100:
+					print("could not place new node, giving up")
+					exit(-1)
 			else:
-				print "first node"
+				if print_sim and nodes_x.size == 0:
+					print("first node")
 				self.x = posx
 				self.y = posy
 				found = 1
-		self.dist = np.sqrt((self.x-bsx)*(self.x-bsx)+(self.y-bsy)*(self.y-bsy))
-		print('node %d %s %s' % (nodeid,  'endDevice' if self.nodeType==endDeviceType else 'relayDevice', \
-																			'expo' if self.distrib==expoDistribType else 'uniform'), \
-														"x", self.x, "y", self.y, "dist: ", self.dist)
+		nodes_x = np.append(nodes_x, self.x)
+		nodes_y = np.append(nodes_y, self.y)
+		self.dist = math.hypot(self.x-bsx, self.y-bsy)
+		if print_sim:
+			print('node %d %s %s' % (nodeid,  'endDevice' if self.nodeType==endDeviceType else 'relayDevice', \
+																				'expo' if self.distrib==expoDistribType else 'uniform'), \
+															"x", self.x, "y", self.y, "dist: ", self.dist)
 		
 		self.packet = myPacket(self.nodeid, packetlen, self.dist)
 		self.data_len=packetlen
 		
-		self.data_rectime = airtime(self.packet.sf,self.packet.cr,self.packet.pl,self.packet.bw)
-		print "rectime for DATA packet ", self.data_rectime
-		self.rts_rectime = airtime(self.packet.sf,self.packet.cr,5,self.packet.bw)
-		print "rectime for RTS packet ", self.rts_rectime
+		self.data_rectime = self.packet.data_rectime
+		if print_sim:
+			print("rectime for DATA packet ", self.data_rectime)
+		self.rts_rectime = self.packet.rts_rectime
+		if print_sim:
+			print("rectime for RTS packet ", self.rts_rectime)
 		self.n_data_sent = 0
 		self.n_rts_sent = 0
 		self.ca_state = schedule_tx
@@ -692,6 +874,7 @@ class myNode():
 		self.n_receive_nav_data_p1=0
 		self.n_receive_nav_data_p2=0		
 		self.nav=0
+		self.nav_airtime=0
 		self.cca=False
 		self.n_cca=0
 		self.n_busy_rts=0
@@ -700,9 +883,7 @@ class myNode():
 		global n_retry
 		self.n_retry=n_retry
 		self.total_retry=0
-		self.retry_bin=[]
-		for i in range(n_retry):
-			self.retry_bin.append(0)		
+		self.retry_bin=retry_bin_template.copy()
 		global n_retry_rts
 		if n_retry_rts>0:
 			self.n_retry_rts=n_retry_rts
@@ -710,9 +891,7 @@ class myNode():
 			#if n_retry_rts<0 then we will not decrement node.n_retry_rts
 			self.n_retry_rts=1
 		self.total_retry_rts=0
-		self.retry_rts_bin=[]
-		for i in range(n_retry_rts+1):
-			self.retry_rts_bin.append(0)						
+		self.retry_rts_bin=retry_rts_bin_template.copy()
 		self.n_aborted=0
 		self.cycle=0
 		global W2
@@ -731,7 +910,13 @@ class myNode():
 # this function creates a packet (associated with a node)
 # it also sets all parameters, currently random
 #
-class myPacket():
+class myPacket(object):
+	#fixed attribute layout, no per-instance __dict__ (lost, addTime and endTime are set when the packet reaches the base station)
+	__slots__ = ('nodeid', 'txpow', 'sf', 'bw', 'cr', 'rectime', 'freqGuard', 'transRange', 'pl',
+		'symTime', 'Tcritical', 'arriveTime', 'rssi', 'freq', 'ptype', 'data_len', 'data_rectime',
+		'rts_rectime', 'max_payload_rectime', 'Tpream', 'collided', 'processed', 'Tpream_W3',
+		'listen_slot', 'sensitivity', 'lost', 'addTime', 'endTime')
+
 	def __init__(self, nodeid, plen, distance):
 		global experiment
 		global Ptx
@@ -747,13 +932,9 @@ class myPacket():
 		self.txpow = Ptx
 
 		# randomize configuration values
-		if lora24GHz:
-			self.sf = random.randint(5,12)
-			self.bw = random.choice([203.125, 406.250, 812.5, 1625])
-		else:	
-			self.sf = random.randint(6,12)
-			self.bw = random.choice([125, 250, 500])
-		self.cr = random.randint(1,4)
+		self.sf = next(sf_pool)
+		self.bw = next(bw_pool)
+		self.cr = next(cr_pool)
 
 		# for certain experiments override these
 		if experiment==1 or experiment == 0:
@@ -789,37 +970,29 @@ class myPacket():
 
 		# log-shadow
 		Lpl = Lpld0 + 10*gamma*math.log10(distance/d0)
-		print "Lpl:", Lpl
+		if print_sim:
+			print("Lpl:", Lpl)
 		Prx = self.txpow - GL - Lpl
 
 		#TODO for lora24GHz
 		if (experiment == 3) or (experiment == 5):
-			minairtime = 9999
-			minsf = 0
-			minbw = 0
-
-			print "Prx:", Prx
-
-			for i in range(0,6):
-				for j in range(1,4):
-					if (sensi[i,j] < Prx):
-						self.sf = int(sensi[i,0])
-						if j==1:
-							self.bw = 125
-						elif j==2:
-							self.bw = 250
-						else:
-							self.bw=500
-						at = airtime(self.sf, 1, plen, self.bw)
-						if at < minairtime:
-							minairtime = at
-							minsf = self.sf
-							minbw = self.bw
-							minsensi = sensi[i, j]
-			if (minairtime == 9999):
-				print "does not reach base station"
+			if print_sim:
+				print("Prx:", Prx)
+
+			#settings, in the same layout than airtime_grid, for which the base station is in range
+			reachable = sensi[0:6,1:4] < Prx
+			if not reachable.any():
+				print("does not reach base station")
 				exit(-1)
-			print "best sf:", minsf, " best bw: ", minbw, "best airtime:", minairtime
+			#unreachable settings get an infinite airtime, argmin then returns the first (row-major) shortest one
+			ats = np.where(reachable, airtime_grid(plen), np.inf)
+			i, j = divmod(int(np.argmin(ats)), ats.shape[1])
+			minairtime = ats[i,j]
+			minsf = int(sensi[i,0])
+			minbw = bw_choices[j]
+			minsensi = sensi[i,j+1]
+			if print_sim:
+				print("best sf:", minsf, " best bw: ", minbw, "best airtime:", minairtime)
 			self.rectime = minairtime
 			self.sf = minsf
 			self.bw = minbw
@@ -829,35 +1002,38 @@ class myPacket():
 				# reduce the txpower if there's room left
 				self.txpow = max(2, self.txpow - math.floor(Prx - minsensi))
 				Prx = self.txpow - GL - Lpl
-				print 'minsesi {} best txpow {}'.format(minsensi, self.txpow)
+				if print_sim:
+					print('minsesi %s best txpow %s' % (minsensi, self.txpow))
 
+		# frequency distance under which there is a collision, see frequencyCollision
+		self.freqGuard = {125:30, 250:60, 500:120}.get(self.bw, 30)
 		# transmission range, needs update XXX
 		self.transRange = 150
 		self.pl = plen
-		self.symTime = (2.0**self.sf)/self.bw
+		self.symTime = pow2_sf[self.sf]/self.bw
+		# used by timingCollision, assuming 8 preamble symbols we can lose at most (8 - 5) * Tsym of our preamble
+		self.Tcritical = self.symTime * (8 - 5)
 		self.arriveTime = 0
 		self.rssi = Prx
 		# frequencies: lower bound + number of 61 Hz steps
 		if lora24GHz:
-			self.freq = 2403000000 + random.randint(0,2622950)
+			self.freq = 2403000000 + next(freq_offset_pool)
 		else:
-			self.freq = 860000000 + random.randint(0,2622950)
+			self.freq = 860000000 + next(freq_offset_pool)
 
 		# for certain experiments override these and
 		# choose some random frequences
 		if experiment == 1:
-			if lora24GHz:
-				self.freq = random.choice([2403000000, 2425000000, 2479000000])
-			else:
-				self.freq = random.choice([860000000, 864000000, 868000000])
+			self.freq = next(freq_pool)
 		else:
 			if lora24GHz:
 				self.freq = 2403000000
 			else:
 				self.freq = 860000000
 	
-		print "frequency" ,self.freq, "symTime ", self.symTime
-		print "bw", self.bw, "sf", self.sf, "cr", self.cr, "rssi", self.rssi
+		if print_sim:
+			print("frequency" ,self.freq, "symTime ", self.symTime)
+			print("bw", self.bw, "sf", self.sf, "cr", self.cr, "rssi", self.rssi)
 
 		self.ptype = dataPacketType
 		#self.data_len will keep the payload length of a data packet
@@ -874,8 +1050,24 @@ class myPacket():
 			Npream = 8	 # number of preamble symbol (12.25	 from Utz paper) 
 			self.Tpream = (Npream + 4.25)*self.symTime		
 		self.rectime = airtime(self.sf,self.cr,self.pl,self.bw)
-		print "rectime node ", self.nodeid, "	 ", self.rectime
-		print "T_Pream node ", self.nodeid, "	 ", self.Tpream		
+		# sf, cr and bw are fixed from now on so the time-on-air of a DATA and of an RTS (5 bytes) are also fixed
+		# as well as the one of the maximum payload size, used for the NAV on a DATA and with Wbusy_add_max_toa
+		self.data_rectime = self.rectime
+		self.rts_rectime = airtime(self.sf,self.cr,5,self.bw)
+		self.max_payload_rectime = airtime(self.sf,self.cr,max_payload_size,self.bw)
+		# durations of the CA procedure with DIFS=preamble duration
+		# listen period is WL*DIFS+TOA(current packet), it is updated by setPacketType
+		self.Tpream_W3 = W3*self.Tpream
+		self.listen_slot = WL*self.Tpream + self.rectime
+		# sf and bw are fixed from now on, keep the matching receiver sensitivity
+		# as a python float so that the rssi test of each transmission does not compare with a numpy scalar
+		if lora24GHz:
+			self.sensitivity = float(sensi[self.sf - 5, bw_choices_24.index(self.bw) + 1])
+		else:
+			self.sensitivity = float(sensi[self.sf - 6, bw_choices.index(self.bw) + 1])
+		if print_sim:
+			print("rectime node ", self.nodeid, "	 ", self.rectime)
+			print("T_Pream node ", self.nodeid, "	 ", self.Tpream)		
 		# denote if packet is collided
 		self.collided = 0
 		self.processed = 0
@@ -885,12 +1077,131 @@ class myPacket():
 		
 		if ptype == rtsPacketType:
 			self.pl=5
-			self.rectime = airtime(self.sf,self.cr,self.pl,self.bw)		 
+			self.rectime = self.rts_rectime
 		else:
 			self.pl=self.data_len
-			self.rectime = airtime(self.sf,self.cr,self.pl,self.bw)
+			self.rectime = self.data_rectime
+		self.listen_slot = WL*self.Tpream + self.rectime
 		
 
+#
+# random.random() of the global generator bound once for the helpers called at each event
+# it is the same generator, so random.seed() still gives reproducible runs
+rand = random.random
+
+#
+# random integer in [lo,hi], same distribution than random.randint(lo,hi)
+# but with a single random.random() call instead of the python-level randint()/randrange() code
+def rand_int(lo,hi):
+	return lo + int(rand()*(hi-lo+1))
+
+#
+# random backoff [Wbusy_min,2**node.Wbusy_BE] when the channel has been found busy by CCA
+# with exponential backoff, node.Wbusy_BE is then incremented up to Wbusy_maxBE
+# returns the time to wait before the next CCA
+def busy_backoff(node):
+	Wbusy_max=Wbusy_pow2[node.Wbusy_BE]
+	node.backoff=rand_int(Wbusy_min,Wbusy_max)
+	if print_sim:
+		print("node %s: channel found busy, backoff with Wbusy=[%s,%s] backoff=%s DIFS=%s" % (node.nodeid, Wbusy_min, Wbusy_max, node.backoff, node.packet.Tpream))
+	node.Wbusy_BE=Wbusy_next_BE[node.Wbusy_BE]
+	return node.backoff*node.packet.Tpream
+
+#
+# clear channel assessment by node, what describes the procedure for the trace
+# if channel is busy, then CCA reliability will decide if we can detect that channel is busy
+# if channel is not busy, as we observed no false positive, the channel is found free
+# when p1 is True, a channel busy by an RTS is also counted in node.n_busy_rts_p1
+# returns True if the channel is found busy
+def probe_channel(node, what, p1=False):
+	node.n_cca = node.n_cca + 1
+	#most probes find a free channel, so return before any other test when there is no trace to print
+	busy=channel_busy
+	if not (busy or print_sim):
+		return False
+	if print_sim:
+		print("node %s %s: %s checking channel" % (node.nodeid, env.now, what))
+	if busy:
+		if print_sim:
+			print("node %s: channel is busy by %s" % (node.nodeid, 'RTS' if busy & channel_busy_rts else 'DATA'))
+		if busy & channel_busy_rts:
+			node.n_busy_rts += 1
+			if p1:
+				node.n_busy_rts_p1 += 1
+		else:
+			node.n_busy_data += 1
+		if rand() < CCA_busy_prob:
+			if print_sim:
+				print("node %s: channel found busy by CCA with %s%%" % (node.nodeid, CCA_prob))
+			return True
+		if print_sim:
+			print("node %s: channel found free by CCA" % node.nodeid)
+		return False
+	if print_sim:
+		print("node %s: channel is free" % node.nodeid)
+	return False
+
+#
+# end of a phase1 (p1 is True) or phase2 listening period during which a ValidHeader from a DATA has been received
+# the node goes into NAV, nav period is the time-on-air of the maximum data size plus [0,Wnav] DIFS
+# returns the remaining time to wait in NAV, 0 if the NAV period is already included in the listening period
+def data_nav_wait(node, p1):
+	node.receive_data = False
+	receive_data_by_sender[node.receive_data_from].discard(node)
+	node.total_listen_time = node.total_listen_time + (node.receive_data_time - node.ca_listen_start_time)
+	if p1:
+		node.n_receive_nav_data_p1 = node.n_receive_nav_data_p1 + 1
+	else:
+		node.n_receive_nav_data_p2 = node.n_receive_nav_data_p2 + 1
+	#nav period is the time-on-air of the maximum data size which is returned in node.nav
+	nav_period=node.nav_airtime
+	#will go into NAV
+	node.ca_state=start_nav
+	#add an additional number of random DIFS [0,Wnav]
+	if Wnav!=0:
+		extra_nav_difs=rand_int(0,Wnav)
+	else:
+		extra_nav_difs=0
+	extra_nav_time=extra_nav_difs*node.packet.Tpream
+	#it can happen that the end of the listening period is after the theoretical NAV period for data packet
+	#in this case, it is not really possible to revert time and the end of the listening period will be the end of the nav period
+	if node.receive_data_time+nav_period+extra_nav_time <= env.now:
+		#in this case, there is no additional delay, we just go to start_nav
+		if print_sim:
+			print("node %s %s: received ValidHeader at %s, NAV period is included in listening period" % (node.nodeid, env.now, node.receive_data_time))
+		return 0
+	if print_sim:
+		print("node %s %s: received ValidHeader at %s go into NAV(%s) + [0,%s]%s DIFS until %s" % (node.nodeid, env.now, node.receive_data_time, nav_period, Wnav, extra_nav_difs, node.receive_data_time+nav_period+extra_nav_time))
+	#adjust to remove the extra time due to the fact that the data should have been received ealier
+	return nav_period+extra_nav_time-(env.now-node.receive_data_time)
+
+#
+# end of a phase1 (p1 is True) or phase2 listening period during which an RTS has been received
+# the node goes into NAV, nav period is one listening period + W3*DIFS + TOA(data) plus [0,Wnav] DIFS
+# returns the remaining time to wait in NAV
+def rts_nav_wait(node, p1):
+	node.receive_rts = False
+	receive_rts_by_sender[node.receive_rts_from].discard(node)
+	node.total_listen_time = node.total_listen_time + (node.receive_rts_time - node.ca_listen_start_time)
+	if p1:
+		node.n_receive_nav_rts_p1 = node.n_receive_nav_rts_p1 + 1
+	else:
+		node.n_receive_nav_rts_p2 = node.n_receive_nav_rts_p2 + 1
+	#nav period is one listening period + W3*DIFS + TOA(data)
+	nav_period=node.packet.listen_slot + node.packet.Tpream_W3 + node.nav_airtime
+	#add an additional number of random DIFS [0,Wnav]
+	if Wnav!=0:
+		extra_nav_difs=rand_int(0,Wnav)
+	else:
+		extra_nav_difs=0
+	extra_nav_time=extra_nav_difs*node.packet.Tpream
+	if print_sim:
+		print("node %s %s: received RTS at %s go into NAV(%s) + [0,%s]%s DIFS until %s" % (node.nodeid, env.now, node.receive_rts_time, nav_period, Wnav, extra_nav_difs, node.receive_rts_time+nav_period+extra_nav_time))
+	#go into NAV
+	node.ca_state=start_nav
+	#adjust to remove the extra time due to the fact that the RTS should have been received ealier
+	return nav_period+extra_nav_time-(env.now-node.receive_rts_time)
+
 #
 # main discrete event loop, runs for each node
 # a global list of packet being processed at the gateway
@@ -919,47 +1230,59 @@ CCA can be realized (check_busy==True) at want_transmit (DATA), start_phase2_rts
 - A node will enter into NAV period upon reception of an RTS or a ValidHeader from DATA
 	- the node will go back to want_transmit, node.n_retry is decremented and packet TX can then be aborted in want_transmit
 - If eventually the data packet is transmitted, then node.latency is updated 
+
+each pass of the while loop tests the state blocks in the order above, a block can yield and change node.ca_state
+and the next blocks of the same pass are then tested with the new state, e.g. start_phase2_backoff -> start_phase2_rts
+-> start_phase2_listen can be done in a single pass. The end of simulation is only tested at the beginning of a pass.
+This is why the blocks are not turned into a dispatch table on node.ca_state: it would change the order in which
+the state changes and the end of simulation are seen and therefore the simulation results
+
+each node keeps its own generator and its state in its myNode object. Moving all node states into arrays advanced
+by a single vectorized scheduler is not done: the nodes interact through channel_busy and
+checkcollision() at every event, so events still have to be processed one at a time in simpy time order and the
+results depend on that order
 """
 
-def transmit(env,node):
+def transmit_node(env, node, WL, W2, W3, Wnav, W2afterNAV, CA, CA1, CA2, experiment,
+		check_busy, check_busy_rts, Wbusy_min, Wbusy_BE, Wbusy_maxBE, Wbusy_exp_backoff,
+		n_retry, n_retry_rts, expoDistribType, uniformDistribType):
+	#every state change waits on a simpy timeout, keep the bound method in a local variable
+	timeout=env.timeout
+	#node.packet is created once with the node and never replaced, read its fields through a local variable
+	packet=node.packet
+	#DIFS=preamble duration, the unit of all the backoff periods
+	Tpream=packet.Tpream
 	while True:
 		global nrLost
 		global nrCollisions
 		global nrReceived
 		global nrProcessed
 
-		global WL
-		global W2
-		global W3	
-		global Wnav			
-		global W2afterNAV
-		global CA
-		global CA1
-		global CA2
-		global experiment
-		global check_busy
-		global check_busy_rts
-		global CCA_prob
-		global channel_busy_rts
-		global channel_busy_data
-		global Wbusy_min
-		global Wbusy_BE
-		global Wbusy_maxBE
-		global Wbusy_exp_backoff
-		global n_retry
-		global n_retry_rts
+		global channel_busy
 		
-		global expoDistribType
-		global uniformDistribType
 		global endDeviceType
 		global relayDeviceType
 		
- 		global n_transmit
- 		global inter_transmit_time
- 		global inter_transmit_time_bin
+		global n_transmit
+		global inter_transmit_time
 		global last_transmit_time
+
+		#end of simulation and progress display, done once per pass before the state blocks
+		#so that a state block can leave the pass early with continue
+		global targetSentPacket
+		#sent = sum(n.n_data_sent for n in nodes)
+		if nrProcessed > targetSentPacket:
+			global endSim
+			endSim=env.now
+			return
 		
-		print "node {}: transmit() simTime {}".format(node.nodeid, env.now)
+		global nextProgressMark
+		if nrProcessed >= nextProgressMark:
+			sys.stderr.write("%d - " % nrProcessed)
+			nextProgressMark=nextProgressMark + progressStep
+		
+		if print_sim:
+			print("node %s: transmit() simTime %s" % (node.nodeid, env.now))
 		
 		###////////////////////////////////////////////////////////
 		# Collision Avoidance                                     /
@@ -982,20 +1305,22 @@ def transmit(env,node):
 					if node.distrib==uniformDistribType:
 						transmit_wait = random.uniform(max(2000,node.period-5000),node.period+5000)		
 				
-				print "node {} {} cycle {}: schedule transmit in {} at {}".format(node.nodeid, env.now, node.cycle, transmit_wait, env.now+transmit_wait)
+				if print_sim:
+					print("node %s %s cycle %s: schedule transmit in %s at %s" % (node.nodeid, env.now, node.cycle, transmit_wait, env.now+transmit_wait))
 
 				node.cycle = node.cycle + 1
 				
 				node.ca_state=want_transmit
 				
-				yield env.timeout(transmit_wait)
+				yield timeout(transmit_wait)
 
 			###############################
 			# want_transmit -> start_CA   #
 			###############################	
-			if node.ca_state==want_transmit and node.packet.ptype==dataPacketType:
+			if node.ca_state==want_transmit and packet.ptype==dataPacketType:
 				if node.n_retry==0:
-					print "node {} {}: current transmission aborted".format(node.nodeid, env.now)
+					if print_sim:
+						print("node %s %s: current transmission aborted" % (node.nodeid, env.now))
 					node.n_aborted = node.n_aborted +1
 					#reset for sending a new packet				
 					node.n_retry=n_retry
@@ -1007,18 +1332,21 @@ def transmit(env,node):
 					if node.cca:
 						#reset cca to start again
 						node.cca=False
-						print "node {} {}: retry {} after CCA".format(node.nodeid, env.now, n_retry-node.n_retry)									
+						if print_sim:
+							print("node %s %s: retry %s after CCA" % (node.nodeid, env.now, n_retry-node.n_retry))									
 					elif node.nav!=0:
 						#reset nav to start again a complete CA procedure
 						node.nav=0						
 						#will we use W2afterNAV after a NAV period?
 						if W2afterNAV!=W2:
 							node.W2=W2afterNAV
-							print "node {} {}: retry {} after NAV -> W2=W2afterNAV={}".format(node.nodeid, env.now, n_retry-node.n_retry, node.W2)
+							if print_sim:
+								print("node %s %s: retry %s after NAV -> W2=W2afterNAV=%s" % (node.nodeid, env.now, n_retry-node.n_retry, node.W2))
 							#TODO still need to see where we are going to introduce W2afterNAV
 						else:
 							node.W2=W2
-							print "node {} {}: retry {} after NAV -> W2={}".format(node.nodeid, env.now, n_retry-node.n_retry, node.W2)						
+							if print_sim:
+								print("node %s %s: retry %s after NAV -> W2=%s" % (node.nodeid, env.now, n_retry-node.n_retry, node.W2))						
 					else:
 						#this is an initial transmit attempt
 						node.want_transmit_time=env.now
@@ -1026,122 +1354,94 @@ def transmit(env,node):
 						if n_transmit > 1:
 							current_inter_transmit_time = env.now - last_transmit_time
 							inter_transmit_time += current_inter_transmit_time
-							#put in bin from 0s to max_inter_transmit_time in second
-							inter_transmit_time_bin[min(int(current_inter_transmit_time/1000), max_inter_transmit_time)] += 1	
+							#binned later by flush_inter_transmit_time()
+							inter_transmit_time_samples.append(current_inter_transmit_time)
+							if len(inter_transmit_time_samples) >= inter_transmit_time_flush:
+								flush_inter_transmit_time()
 						last_transmit_time = env.now		
 						
 					channel_find_busy=False
 				
 					if check_busy:
-						node.n_cca = node.n_cca + 1
-						print "node {} {}: CA want_transmit checking channel".format(node.nodeid, env.now)
-						#if channel is busy, then CCA reliability will decide if we can detect that channel is busy
-						#if channel is not busy, as we observed no false positive, so channel_find_busy remains False
-						if channel_busy_rts or channel_busy_data:
-							print "node {}: channel is busy by {}".format(node.nodeid, 'RTS' if channel_busy_rts else 'DATA')
-							if channel_busy_rts:
-								node.n_busy_rts += 1
-								node.n_busy_rts_p1 += 1
-							else:
-								node.n_busy_data += 1	
-							if random.randint(1,100) <= CCA_prob and CCA_prob!=0:
-								channel_find_busy=True
-								print "node {}: channel found busy by CCA with {}%".format(node.nodeid, CCA_prob)
-							else:
-								channel_find_busy=False
-								print "node {}: channel found free by CCA".format(node.nodeid)		
-						else:
-							print "node {}: channel is free".format(node.nodeid)						
+						channel_find_busy=probe_channel(node, "CA want_transmit", p1=True)
 				
 					#print "node {}: TEST -> force channel found free".format(node.nodeid)
 					#channel_find_busy=False
 				
 					if channel_find_busy:
 						#here we just delay by a random backoff timer to retry again
-						#random backoff [Wbusy_min,2**Wbusy_BE]
-						node.backoff=random.randint(Wbusy_min,2**node.Wbusy_BE)
-						print "node {}: channel found busy, backoff with Wbusy=[{},{}] backoff={} DIFS={}".format(node.nodeid, Wbusy_min, 2**node.Wbusy_BE, node.backoff, node.packet.Tpream)
+						#the next CCA is done in a new pass of want_transmit, after the end of simulation test,
+						#and sees the channel state at that time so the retries cannot be drawn in advance
+						backoff_wait=busy_backoff(node)
 						node.cca=True
-						if Wbusy_exp_backoff:
-							if node.Wbusy_BE<Wbusy_maxBE:
-								node.Wbusy_BE=node.Wbusy_BE + 1
-						print "node {}: number of retries left {}".format(node.nodeid, node.n_retry)		
+						if print_sim:
+							print("node %s: number of retries left %s" % (node.nodeid, node.n_retry))		
 						node.n_retry = node.n_retry - 1							
-						yield env.timeout(node.backoff*node.packet.Tpream)
+						yield timeout(backoff_wait)
+						#still in want_transmit, none of the next blocks apply
+						continue
 					else:					
 						#determine if the node starts in phase 1 (listen for RTS) or in phase 2 (send RTS after backoff)
-						node.my_P=random.randint(0,100)
+						node.my_P=rand_int(0,100)
 						node.ca_state=start_CA
-						print "node {} {}: start_CA with P={} my_P={}".format(node.nodeid, env.now, node.P, node.my_P)
+						if print_sim:
+							print("node %s %s: start_CA with P=%s my_P=%s" % (node.nodeid, env.now, node.P, node.my_P))
 						#change packet type to get the correct time-on-air
-						node.packet.setPacketType(rtsPacketType)
+						packet.setPacketType(rtsPacketType)
 
 			#########################################################
 			# start_CA -> start_phase_listen | start_phase2_backoff #
 			#########################################################
-			if node.ca_state==start_CA and node.packet.ptype==rtsPacketType:							
+			if node.ca_state==start_CA and packet.ptype==rtsPacketType:							
 				if node.my_P > node.P:	
 					#starts in phase 1
 					node.ca_state=start_phase1_listen
+					listening_nodes.add(node)
 					#store time at which listening period began
 					node.ca_listen_start_time=env.now
-					node.ca_listen_end_time=env.now+(WL*node.packet.Tpream+node.packet.rectime)
-					print "node {} {}: start_phase1_listen with WL={} DIFS={} TOA(RTS)={} until {}".format(node.nodeid, env.now, WL, node.packet.Tpream, node.packet.rectime, node.ca_listen_end_time)					
+					node.ca_listen_end_time=env.now+packet.listen_slot
+					if print_sim:
+						print("node %s %s: start_phase1_listen with WL=%s DIFS=%s TOA(RTS)=%s until %s" % (node.nodeid, env.now, WL, Tpream, packet.rectime, node.ca_listen_end_time))					
 					#listen period is at least WL*DIFS+TOA(RTS), with DIFS=preamble duration
-					yield env.timeout(WL*node.packet.Tpream+node.packet.rectime)
+					yield timeout(packet.listen_slot)
 				else:
 					#starts in phase 2
 					node.ca_state=start_phase2_backoff
 					if CA2:
 						#here, we decided to keep same W2, but your change it for CA2 specifically
 						#for instance random backoff [0,2*W2]
-						node.backoff=random.randint(0,W2)
-						print "node {} {}: CA2 variant".format(node.nodeid, env.now)
-						print "node {} {}: start_phase2_backoff with CA2_W2={} backoff={} DIFS={}".format(node.nodeid, env.now, W2, node.backoff, node.packet.Tpream)					
+						node.backoff=rand_int(0,W2)
+						if print_sim:
+							print("node %s %s: CA2 variant" % (node.nodeid, env.now))
+							print("node %s %s: start_phase2_backoff with CA2_W2=%s backoff=%s DIFS=%s" % (node.nodeid, env.now, W2, node.backoff, Tpream))					
 					else:
 						#random backoff [0,W2]
-						node.backoff=random.randint(0,W2)
-						print "node {} {}: start_phase2_backoff with W2={} backoff={} DIFS={}".format(node.nodeid, env.now, W2, node.backoff, node.packet.Tpream)
+						node.backoff=rand_int(0,W2)
+						if print_sim:
+							print("node %s %s: start_phase2_backoff with W2=%s backoff=%s DIFS=%s" % (node.nodeid, env.now, W2, node.backoff, Tpream))
 					#backoff period is backoff*DIFS, with DIFS=preamble duration
-					yield env.timeout(node.backoff*node.packet.Tpream)
+					yield timeout(node.backoff*Tpream)
 
 			###########################################################
 			# start_phase1_listen -> start_nav | start_phase2_backoff #
 			###########################################################
 			#node was in start_phase1_listen and it did not receive an RTS
 			if node.ca_state==start_phase1_listen and node.receive_rts==False:
+				listening_nodes.discard(node)
 				#did we receive a DATA with a ValidHeader?
 				if node.receive_data==True:
-					node.total_listen_time = node.total_listen_time + (node.receive_data_time - node.ca_listen_start_time) 
-					node.receive_data = False
-					node.n_receive_nav_data_p1 = node.n_receive_nav_data_p1 + 1
-					#nav period is the time-on-air of the maximum data size which is returned in node.nav
-					nav_period=airtime(node.packet.sf,node.packet.cr,node.nav,node.packet.bw)
-					#will go into NAV
-					node.ca_state=start_nav				
-					#add an additional number of random DIFS [0,Wnav]
-					if Wnav!=0:
-						extra_nav_difs=random.randint(0,Wnav)
-					else:
-						extra_nav_difs=0									
-					#it can happen that the end of the listening period is after the theoretical NAV period	for data packet
-					#in this case, it is not really possible to revert time and the end of the listening period will be the end of the nav period
-					if node.receive_data_time+nav_period+extra_nav_difs*node.packet.Tpream <= env.now:
-						#in this case, there is no additional delay, we just go to start_nav
-						print "node {} {}: received ValidHeader at {}, NAV period is included in listening period".format(node.nodeid, env.now, node.receive_data_time)
-					else:						
-						print "node {} {}: received ValidHeader at {} go into NAV({}) + [0,{}]{} DIFS until {}".format(node.nodeid, env.now, node.receive_data_time, nav_period, Wnav, extra_nav_difs, node.receive_data_time+nav_period+extra_nav_difs*node.packet.Tpream)
-						#adjust to remove the extra time due to the fact that the data should have been received ealier					
-						nav_period=nav_period+extra_nav_difs*node.packet.Tpream-(env.now-node.receive_data_time)					
-						yield env.timeout(nav_period)			
+					nav_wait=data_nav_wait(node, True)
+					if nav_wait:
+						yield timeout(nav_wait)
 				else:
 					#random backoff [0,W2]
-					node.backoff=random.randint(0,W2)
-					print "node {} {}: start_phase2_backoff with W2={} backoff={} DIFS={}".format(node.nodeid, env.now, W2, node.backoff, node.packet.Tpream)				
+					node.backoff=rand_int(0,W2)
+					if print_sim:
+						print("node %s %s: start_phase2_backoff with W2=%s backoff=%s DIFS=%s" % (node.nodeid, env.now, W2, node.backoff, Tpream))				
 					#starts phase 2
 					node.ca_state=start_phase2_backoff
 					#backoff period is backoff*DIFS, with DIFS=preamble duration
-					yield env.timeout(node.backoff*node.packet.Tpream)		
+					yield timeout(node.backoff*Tpream)		
 
 			###########################################################
 			# start_phase1_listen -> start_nav(RTS)                   #
@@ -1149,22 +1449,8 @@ def transmit(env,node):
 			#node was in start_phase1_listen and it did receive an RTS
 			#we process this event at the end of the listening period, normally the RTS has been received in the past
 			if node.ca_state==start_phase1_listen and node.receive_rts==True:
-				node.receive_rts = False
-				node.total_listen_time = node.total_listen_time + (node.receive_rts_time - node.ca_listen_start_time)
-				node.n_receive_nav_rts_p1 = node.n_receive_nav_rts_p1 + 1
-				#nav period is one listening period + W3*DIFS + TOA(data)
-				nav_period=WL*node.packet.Tpream+node.packet.rectime + W3*node.packet.Tpream + airtime(node.packet.sf,node.packet.cr,node.nav,node.packet.bw)
-				#add an additional number of random DIFS [0,Wnav]
-				if Wnav!=0:
-					extra_nav_difs=random.randint(0,Wnav)
-				else:
-					extra_nav_difs=0
-				print "node {} {}: received RTS at {} go into NAV({}) + [0,{}]{} DIFS until {}".format(node.nodeid, env.now, node.receive_rts_time, nav_period, Wnav, extra_nav_difs, node.receive_rts_time+nav_period+extra_nav_difs*node.packet.Tpream)
-				#adjust to remove the extra time due to the fact that the RTS should have been received ealier
-				nav_period=nav_period+extra_nav_difs*node.packet.Tpream-(env.now-node.receive_rts_time)
-				#go into NAV
-				node.ca_state=start_nav			
-				yield env.timeout(nav_period)
+				listening_nodes.discard(node)
+				yield timeout(rts_nav_wait(node, True))
 
 			###########################################################
 			# start_phase2_backoff -> start_phase2_rts                #
@@ -1184,25 +1470,7 @@ def transmit(env,node):
 			
 				while node.n_retry_rts and channel_find_busy:
 					if check_busy_rts:
-						node.n_cca = node.n_cca + 1
-						print "node {} {}: phase2 prior to send RTS checking channel".format(node.nodeid, env.now)
-						#if channel is busy, then CCA reliability will decide if we can detect that channel is busy
-						#if channel is not busy, as we observed no false positive, so channel_find_busy remains False
-						if channel_busy_rts or channel_busy_data:
-							print "node {}: channel is busy by {}".format(node.nodeid, 'RTS' if channel_busy_rts else 'DATA')
-							if channel_busy_rts:
-								node.n_busy_rts += 1
-							else:
-								node.n_busy_data += 1
-							if random.randint(1,100) <= CCA_prob and CCA_prob!=0:
-								channel_find_busy=True
-								print "node {}: channel found busy by CCA with {}%".format(node.nodeid, CCA_prob)
-							else:
-								channel_find_busy=False
-								print "node {}: channel found free by CCA".format(node.nodeid)		
-						else:
-							channel_find_busy=False
-							print "node {}: channel is free".format(node.nodeid)						
+						channel_find_busy=probe_channel(node, "phase2 prior to send RTS")
 					else:
 						channel_find_busy=False
 				
@@ -1211,70 +1479,69 @@ def transmit(env,node):
 			
 					if channel_find_busy:
 						#here we just delay by a random backoff timer to retry again
-						#random backoff [Wbusy_min,2**Wbusy_BE]
-						node.backoff=random.randint(Wbusy_min,2**node.Wbusy_BE)
-						print "node {}: channel found busy, backoff with Wbusy=[{},{}] backoff={} DIFS={}".format(node.nodeid, Wbusy_min, 2**node.Wbusy_BE, node.backoff, node.packet.Tpream)
-						if Wbusy_exp_backoff:
-							if node.Wbusy_BE<Wbusy_maxBE:
-								node.Wbusy_BE=node.Wbusy_BE + 1
-						print "node {}: number of retries left {}".format(node.nodeid, node.n_retry_rts)
+						#the channel state may have changed by the next CCA so each retry is a separate event
+						backoff_wait=busy_backoff(node)
+						if print_sim:
+							print("node %s: number of retries left %s" % (node.nodeid, node.n_retry_rts))
 						#if n_retry_rts<0 then we will not decrement node.n_retry_rts
 						if n_retry_rts>0:		
 							node.n_retry_rts = node.n_retry_rts - 1
-						yield env.timeout(node.backoff*node.packet.Tpream)
+						yield timeout(backoff_wait)
 
 				#after n_retry_rts, we transmit anyway
 				if node.n_retry_rts==0:
-					print "node {}: {} RTS max number of transmission reached, transmit anyway".format(node.nodeid, n_retry_rts)
+					if print_sim:
+						print("node %s: %s RTS max number of transmission reached, transmit anyway" % (node.nodeid, n_retry_rts))
 
 				# RTS time sending and receiving
 				# RTS packet arrives -> add to base station
-				print "node {} {}: transmit RTS toa {} transmission ends at {}".format(node.nodeid, env.now, node.packet.rectime, env.now+node.packet.rectime)
+				if print_sim:
+					print("node %s %s: transmit RTS toa %s transmission ends at %s" % (node.nodeid, env.now, packet.rectime, env.now+packet.rectime))
 				node.n_rts_sent = node.n_rts_sent + 1
 				node.total_retry_rts += n_retry_rts - node.n_retry_rts
 				node.retry_rts_bin[n_retry_rts - node.n_retry_rts] += 1				
-				if (node in packetsAtBS):
-					print "ERROR: RTS packet already in"
+				if (node in packetsAtBS_set):
+					if print_sim:
+						print("ERROR: RTS packet already in")
 				else:
-					if lora24GHz:
-						sensitivity = sensi[node.packet.sf - 5, [203.125,406.25,812.5,1625].index(node.packet.bw) + 1]
+					if packet.rssi < packet.sensitivity:
+						if print_sim:
+							print("node %s %s: RTS packet will be lost" % (node.nodeid, env.now))
+						packet.lost = True
 					else:
-						sensitivity = sensi[node.packet.sf - 6, [125,250,500].index(node.packet.bw) + 1]
-					if node.packet.rssi < sensitivity:
-						print "node {} {}: RTS packet will be lost".format(node.nodeid, env.now)
-						node.packet.lost = True
-					else:
-						node.packet.lost = False
-						checkcollision(node.packet)
-						packetsAtBS.append(node)
-						node.packet.addTime = env.now
-
-				channel_busy_rts=True
-				yield env.timeout(node.packet.rectime)
-				channel_busy_rts=False
+						packet.lost = False
+						checkcollision(packet)
+						addPacketAtBS(node)
+						packet.addTime = env.now
+						packet.endTime = env.now + packet.rectime
+
+				channel_busy|=channel_busy_rts
+				yield timeout(packet.rectime)
+				channel_busy&=~channel_busy_rts
 				
-				if node.packet.lost:
+				if packet.lost:
 					global nrRTSLost
 					nrRTSLost += 1
-				if node.packet.collided == 1:
+				if packet.collided == 1:
 					global nrRTSCollisions
 					nrRTSCollisions = nrRTSCollisions +1
-				if node.packet.collided == 0 and not node.packet.lost:
+				if packet.collided == 0 and not packet.lost:
 					global nrRTSReceived
 					nrRTSReceived = nrRTSReceived + 1
-					print "node {} {}: RTS packet has been correctly transmitted".format(node.nodeid, env.now)
-				if node.packet.processed == 1:
+					if print_sim:
+						print("node %s %s: RTS packet has been correctly transmitted" % (node.nodeid, env.now))
+				if packet.processed == 1:
 					global nrRTSProcessed
 					nrRTSProcessed = nrRTSProcessed + 1
 
 				# complete packet has been received by base station
 				# can remove it
-				if (node in packetsAtBS):
-					packetsAtBS.remove(node)
+				if (node in packetsAtBS_set):
+					removePacketAtBS(node)
 				# reset the packet
-				node.packet.collided = 0
-				node.packet.processed = 0
-				node.packet.lost = False			
+				packet.collided = 0
+				packet.processed = 0
+				packet.lost = False			
 
 			###########################################################
 			# start_phase2_rts -> start_phase2_listen                 #
@@ -1285,58 +1552,44 @@ def transmit(env,node):
 					#starts phase 3
 					node.ca_state=start_phase3_backoff
 					#random backoff [0,W3]
-					node.backoff=random.randint(0,W3)
-					print "node {} {}: CA1 variant".format(node.nodeid, env.now)
-					print "node {} {}: start_phase3_backoff with W3={} backoff={} DIFS={}".format(node.nodeid, env.now, W3, node.backoff, node.packet.Tpream)
+					node.backoff=rand_int(0,W3)
+					if print_sim:
+						print("node %s %s: CA1 variant" % (node.nodeid, env.now))
+						print("node %s %s: start_phase3_backoff with W3=%s backoff=%s DIFS=%s" % (node.nodeid, env.now, W3, node.backoff, Tpream))
 					#backoff period is backoff*DIFS, with DIFS=preamble duration
-					yield env.timeout(node.backoff*node.packet.Tpream)
+					yield timeout(node.backoff*Tpream)
 				else:					
 					#we have sent RTS, so go for another listening period
 					node.ca_state=start_phase2_listen			
+					listening_nodes.add(node)
 					#store time at which listening period began
 					node.ca_listen_start_time=env.now
-					node.ca_listen_end_time=env.now+(WL*node.packet.Tpream+node.packet.rectime)
-					print "node {} {}: start_phase2_listen with WL={} DIFS={} TOA(RTS)={} until {}".format(node.nodeid, env.now, WL, node.packet.Tpream, node.packet.rectime, node.ca_listen_end_time)
+					node.ca_listen_end_time=env.now+packet.listen_slot
+					if print_sim:
+						print("node %s %s: start_phase2_listen with WL=%s DIFS=%s TOA(RTS)=%s until %s" % (node.nodeid, env.now, WL, Tpream, packet.rectime, node.ca_listen_end_time))
 					#listen period is at least WL*DIFS+TOA(RTS), with DIFS=preamble duration
-					yield env.timeout(WL*node.packet.Tpream+node.packet.rectime)
+					yield timeout(packet.listen_slot)
 
 			###########################################################
 			# start_phase2_listen -> start_nav | start_phase3_backoff #
 			###########################################################
 			#node was in start_phase2_listen and it did not receive an RTS
 			if node.ca_state==start_phase2_listen and node.receive_rts==False:
+				listening_nodes.discard(node)
 				#did we receive a DATA with a ValidHeader?
 				if node.receive_data==True:
-					node.receive_data = False
-					node.total_listen_time = node.total_listen_time + (node.receive_data_time - node.ca_listen_start_time)
-					node.n_receive_nav_data_p2 = node.n_receive_nav_data_p2 + 1				
-					#nav period is the time-on-air of the maximum data size which is returned in node.nav
-					nav_period=airtime(node.packet.sf,node.packet.cr,node.nav,node.packet.bw)
-					#will go into NAV
-					node.ca_state=start_nav
-					#add an additional number of random DIFS [0,Wnav]
-					if Wnav!=0:
-						extra_nav_difs=random.randint(0,Wnav)
-					else:
-						extra_nav_difs=0												
-					#it can happen that the end of the listening period is after the theoretical NAV period for data packet
-					#in this case, it is not really possible to revert time and the end of the listening period will be the end of the nav period
-					if node.receive_data_time+nav_period+extra_nav_difs*node.packet.Tpream <= env.now:
-						#in this case, there is no additional delay, we just go to start_nav
-						print "node {} {}: received ValidHeader at {}, NAV period is included in listening period".format(node.nodeid, env.now, node.receive_data_time)
-					else:							
-						print "node {} {}: received ValidHeader at {} go into NAV({}) + [0,{}]{} DIFS until {}".format(node.nodeid, env.now, node.receive_data_time, nav_period, Wnav, extra_nav_difs, node.receive_data_time+nav_period+extra_nav_difs*node.packet.Tpream)
-						#adjust to remove the extra time due to the fact that the data should have been received ealier					
-						nav_period=nav_period+extra_nav_difs*node.packet.Tpream-(env.now-node.receive_data_time)					
-						yield env.timeout(nav_period)		
+					nav_wait=data_nav_wait(node, False)
+					if nav_wait:
+						yield timeout(nav_wait)
 				else:		
 					#starts phase 3
 					node.ca_state=start_phase3_backoff
 					#random backoff [0,W3]
-					node.backoff=random.randint(0,W3)
-					print "node {} {}: start_phase3_backoff with W3={} backoff={} DIFS={}".format(node.nodeid, env.now, W3, node.backoff, node.packet.Tpream)
+					node.backoff=rand_int(0,W3)
+					if print_sim:
+						print("node %s %s: start_phase3_backoff with W3=%s backoff=%s DIFS=%s" % (node.nodeid, env.now, W3, node.backoff, Tpream))
 					#backoff period is backoff*DIFS, with DIFS=preamble duration
-					yield env.timeout(node.backoff*node.packet.Tpream)
+					yield timeout(node.backoff*Tpream)
 
 			###########################################################
 			# start_phase2_listen -> start_nav (RTS)                  #
@@ -1344,22 +1597,8 @@ def transmit(env,node):
 			#node was in start_phase2_listen and it did receive an RTS
 			#we process this event at the end of the listening period, normally the RTS has been received in the past
 			if node.ca_state==start_phase2_listen and node.receive_rts==True:
-				node.receive_rts = False
-				node.total_listen_time = node.total_listen_time + (node.receive_rts_time - node.ca_listen_start_time)
-				node.n_receive_nav_rts_p2 = node.n_receive_nav_rts_p2 + 1			
-				#nav period is one listening period + W3*DIFS + TOA(data)
-				nav_period=WL*node.packet.Tpream+node.packet.rectime + W3*node.packet.Tpream + airtime(node.packet.sf,node.packet.cr,node.nav,node.packet.bw)
-				#add an additional number of random DIFS [0,Wnav]
-				if Wnav!=0:
-					extra_nav_difs=random.randint(0,Wnav)
-				else:
-					extra_nav_difs=0
-				print "node {} {}: received RTS at {} go into NAV({}) + [0,{}]{} DIFS until {}".format(node.nodeid, env.now, node.receive_rts_time, nav_period, Wnav, extra_nav_difs, node.receive_rts_time+nav_period+extra_nav_difs*node.packet.Tpream)
-				#adjust to remove the extra time due to the fact that the RTS should have been received ealier
-				nav_period=nav_period+extra_nav_difs*node.packet.Tpream-(env.now-node.receive_rts_time)
-				#go into NAV
-				node.ca_state=start_nav			
-				yield env.timeout(nav_period)
+				listening_nodes.discard(node)
+				yield timeout(rts_nav_wait(node, False))
 
 			###########################################################
 			# start_phase3_backoff -> start_phase3_transmit           #
@@ -1368,40 +1607,24 @@ def transmit(env,node):
 				#we sent the DATA
 				node.ca_state=start_phase3_transmit
 				#change packet type to get the correct tine-on-air
-				node.packet.setPacketType(dataPacketType)				
+				packet.setPacketType(dataPacketType)				
 
 			###########################################################
 			# start_phase3_transmit -> want_transmit | transmit DATA  #
 			###########################################################				
-			if node.ca_state==start_phase3_transmit and node.packet.ptype==dataPacketType:		
+			if node.ca_state==start_phase3_transmit and packet.ptype==dataPacketType:		
 				channel_find_busy=False
 			
 				if check_busy:
-					node.n_cca = node.n_cca + 1
-					print "node {} {}: phase3 prior to send DATA checking channel".format(node.nodeid, env.now)
-					#if channel is busy, then CCA reliability will decide if we can detect that channel is busy
-					#if channel is not busy, as we observed no false positive, so channel_find_busy remains False
-					if channel_busy_rts or channel_busy_data:
-						print "node {}: channel is busy by {}".format(node.nodeid, 'RTS' if channel_busy_rts else 'DATA')
-						if channel_busy_rts:
-							node.n_busy_rts += 1
-						else:
-							node.n_busy_data += 1
-						if random.randint(1,100) <= CCA_prob and CCA_prob!=0:
-							channel_find_busy=True
-							print "node {}: channel found busy by CCA with {}%".format(node.nodeid, CCA_prob)
-						else:
-							channel_find_busy=False
-							print "node {}: channel found free by CCA".format(node.nodeid)		
-					else:
-						print "node {}: channel is free".format(node.nodeid)						
+					channel_find_busy=probe_channel(node, "phase3 prior to send DATA")
 			
 				#print "node {}: TEST -> force channel found free".format(node.nodeid)
 				#channel_find_busy=False
 			
 				if channel_find_busy:
 					node.cca=True
-					print "node {}: number of retries left {}".format(node.nodeid, node.n_retry)
+					if print_sim:
+						print("node %s: number of retries left %s" % (node.nodeid, node.n_retry))
 					node.n_retry = node.n_retry - 1							
 					#and then we try again from the beginning of the CA procedure
 					#we are not retrying several time the Wbusy procedure because if we reach this stage and channel is busy
@@ -1410,52 +1633,56 @@ def transmit(env,node):
 				else:						 
 					# DATA time sending and receiving
 					# DATA packet arrives -> add to base station
-					print "node {} {}: transmit DATA toa {} latency {} transmission ends at {}".format(node.nodeid, env.now, node.packet.rectime, env.now-node.want_transmit_time, env.now+node.packet.rectime)
+					if print_sim:
+						print("node %s %s: transmit DATA toa %s latency %s transmission ends at %s" % (node.nodeid, env.now, packet.rectime, env.now-node.want_transmit_time, env.now+packet.rectime))
 					node.n_data_sent = node.n_data_sent + 1
 					node.total_retry += n_retry - node.n_retry
 					node.retry_bin[n_retry - node.n_retry] += 1
 					node.latency = node.latency + (env.now-node.want_transmit_time)
-					print "node {} : mean latency {}".format(node.nodeid, node.latency/node.n_data_sent)
-					if (node in packetsAtBS):
-						print "ERROR: DATA packet already in"
+					if print_sim:
+						print("node %s : mean latency %s" % (node.nodeid, node.latency/node.n_data_sent))
+					if (node in packetsAtBS_set):
+						if print_sim:
+							print("ERROR: DATA packet already in")
 					else:
-						if lora24GHz:
-							sensitivity = sensi[node.packet.sf - 5, [203.125,406.25,812.5,1625].index(node.packet.bw) + 1]
+						if packet.rssi < packet.sensitivity:
+							if print_sim:
+								print("node %s: DATA packet will be lost" % node.nodeid)
+							packet.lost = True
 						else:
-							sensitivity = sensi[node.packet.sf - 6, [125,250,500].index(node.packet.bw) + 1]
-						if node.packet.rssi < sensitivity:
-							print "node {}: DATA packet will be lost".format(node.nodeid)
-							node.packet.lost = True
-						else:
-							node.packet.lost = False
-							checkcollision(node.packet)
-							packetsAtBS.append(node)
-							node.packet.addTime = env.now
-
-					channel_busy_data=True
-					yield env.timeout(node.packet.rectime)
-					channel_busy_data=False
+							packet.lost = False
+							checkcollision(packet)
+							addPacketAtBS(node)
+							packet.addTime = env.now
+							packet.endTime = env.now + packet.rectime
+
+					channel_busy|=channel_busy_data
+					yield timeout(packet.rectime)
+					channel_busy&=~channel_busy_data
 				
-					if node.packet.lost:
+					if packet.lost:
 						nrLost += 1
-						print "node {} {}: DATA packet was lost".format(node.nodeid, env.now)
-					if node.packet.collided == 1:
+						if print_sim:
+							print("node %s %s: DATA packet was lost" % (node.nodeid, env.now))
+					if packet.collided == 1:
 						nrCollisions = nrCollisions + 1
-						print "node {} {}: DATA packet was collided".format(node.nodeid, env.now)
-					if node.packet.collided == 0 and not node.packet.lost:
+						if print_sim:
+							print("node %s %s: DATA packet was collided" % (node.nodeid, env.now))
+					if packet.collided == 0 and not packet.lost:
 						nrReceived = nrReceived + 1
-						print "node {} {}: DATA packet has been correctly transmitted".format(node.nodeid, env.now)
-					if node.packet.processed == 1:
+						if print_sim:
+							print("node %s %s: DATA packet has been correctly transmitted" % (node.nodeid, env.now))
+					if packet.processed == 1:
 						nrProcessed = nrProcessed + 1
 
 					# complete packet has been received by base station
 					# can remove it
-					if (node in packetsAtBS):
-						packetsAtBS.remove(node)
+					if (node in packetsAtBS_set):
+						removePacketAtBS(node)
 					# reset the packet
-					node.packet.collided = 0
-					node.packet.processed = 0
-					node.packet.lost = False
+					packet.collided = 0
+					packet.processed = 0
+					packet.lost = False
 					node.n_retry=n_retry
 					node.cca=False
 					node.nav=0
@@ -1468,8 +1695,9 @@ def transmit(env,node):
 				#we arrive at the end of the nav period
 				#so we try again from the beginning of the CA procedure
 				node.ca_state=want_transmit
-				node.packet.setPacketType(dataPacketType)
-				print "node {} {}: number of retries left {}".format(node.nodeid, env.now, node.n_retry)
+				packet.setPacketType(dataPacketType)
+				if print_sim:
+					print("node %s %s: number of retries left %s" % (node.nodeid, env.now, node.n_retry))
 				node.n_retry = node.n_retry - 1	
 
 		###////////////////////////////////////////////////////////				
@@ -1487,11 +1715,12 @@ def transmit(env,node):
 			else:
 				transmit_wait = random.expovariate(1.0/float(node.period))
 
-			print "node {} cycle {}: will try transmit in {} at {}".format(node.nodeid, node.cycle, transmit_wait, env.now+transmit_wait)
+			if print_sim:
+				print("node %s cycle %s: will try transmit in %s at %s" % (node.nodeid, node.cycle, transmit_wait, env.now+transmit_wait))
 
 			node.cycle = node.cycle + 1
 			
-			yield env.timeout(transmit_wait)
+			yield timeout(transmit_wait)
 
 			node.want_transmit_time=env.now
 			
@@ -1499,30 +1728,18 @@ def transmit(env,node):
 			if n_transmit > 1:
 				current_inter_transmit_time = env.now - last_transmit_time
 				inter_transmit_time += current_inter_transmit_time
-				#put in bin from 0s to max_inter_transmit_time in second
-				inter_transmit_time_bin[min(int(current_inter_transmit_time/1000), max_inter_transmit_time)] += 1	
+				#binned later by flush_inter_transmit_time()
+				inter_transmit_time_samples.append(current_inter_transmit_time)
+				if len(inter_transmit_time_samples) >= inter_transmit_time_flush:
+					flush_inter_transmit_time()
 			last_transmit_time = env.now				
 			
 			channel_find_busy=True
 			
 			while node.n_retry and channel_find_busy:
 				if check_busy:
-					node.n_cca = node.n_cca + 1
-					print "node {} {}: noCA want_transmit checking channel".format(node.nodeid, env.now)
-					#if channel is busy, then CCA reliability will decide if we can detect that channel is busy
-					#if channel is not busy, as we observed no false positive, so channel_find_busy remains False
-					if channel_busy_data:
-						print "node {}: channel is busy".format(node.nodeid)
-						node.n_busy_data += 1
-						if random.randint(1,100) <= CCA_prob and CCA_prob!=0:
-							channel_find_busy=True
-							print "node {}: channel found busy by CCA with {}%".format(node.nodeid, CCA_prob)
-						else:
-							channel_find_busy=False
-							print "node {}: channel found free by CCA".format(node.nodeid)		
-					else:
-						channel_find_busy=False
-						print "node {}: channel is free".format(node.nodeid)						
+					#without CA there is no RTS so only the channel_busy_data bit can be set
+					channel_find_busy=probe_channel(node, "noCA want_transmit")
 				else:
 					channel_find_busy=False
 				
@@ -1531,92 +1748,94 @@ def transmit(env,node):
 			
 				if channel_find_busy:
 					#here we just delay by a random backoff timer to retry again
-					#random backoff [Wbusy_min,2**Wbusy_BE]
-					node.backoff=random.randint(Wbusy_min,2**node.Wbusy_BE)
-					print "node {}: channel found busy, backoff with Wbusy=[{},{}] backoff={} DIFS={}".format(node.nodeid, Wbusy_min, 2**node.Wbusy_BE, node.backoff, node.packet.Tpream)
-					if Wbusy_exp_backoff:
-						if node.Wbusy_BE<Wbusy_maxBE:
-							node.Wbusy_BE=node.Wbusy_BE + 1
-					print "node {}: number of retries left {}".format(node.nodeid, node.n_retry)
+					backoff_wait=busy_backoff(node)
+					if print_sim:
+						print("node %s: number of retries left %s" % (node.nodeid, node.n_retry))
 					node.n_retry = node.n_retry - 1
 					if Wbusy_add_max_toa:			
-						print "node {}: adding toa({})={}".format(node.nodeid, max_payload_size, airtime(node.packet.sf,node.packet.cr,max_payload_size,node.packet.bw))
-						yield env.timeout(airtime(node.packet.sf,node.packet.cr,max_payload_size,node.packet.bw)+node.backoff*node.packet.Tpream)
+						if print_sim:
+							print("node %s: adding toa(%s)=%s" % (node.nodeid, max_payload_size, packet.max_payload_rectime))
+						yield timeout(packet.max_payload_rectime+backoff_wait)
 					else:
-						yield env.timeout(node.backoff*node.packet.Tpream)	
+						yield timeout(backoff_wait)	
 
 			if node.n_retry==0:
-				print "node {} {}: current transmission aborted".format(node.nodeid, env.now)
+				if print_sim:
+					print("node %s %s: current transmission aborted" % (node.nodeid, env.now))
 				node.n_aborted = node.n_aborted +1
 				node.n_retry=n_retry
 				node.Wbusy_BE=Wbusy_BE
 			else:	
-				print "node {} {}: transmit DATA toa {} latency {} transmission ends at {}".format(node.nodeid, env.now, node.packet.rectime, env.now-node.want_transmit_time, env.now+node.packet.rectime)								
+				if print_sim:
+					print("node %s %s: transmit DATA toa %s latency %s transmission ends at %s" % (node.nodeid, env.now, packet.rectime, env.now-node.want_transmit_time, env.now+packet.rectime))								
 				node.n_data_sent = node.n_data_sent + 1
 				node.total_retry += n_retry - node.n_retry
 				node.retry_bin[n_retry - node.n_retry] += 1				
 				node.latency = node.latency + (env.now-node.want_transmit_time)
-				print "node {} : mean latency {}".format(node.nodeid, node.latency/node.n_data_sent)			
-				if (node in packetsAtBS):
-					print "ERROR: DATA packet already in"
+				if print_sim:
+					print("node %s : mean latency %s" % (node.nodeid, node.latency/node.n_data_sent))			
+				if (node in packetsAtBS_set):
+					if print_sim:
+						print("ERROR: DATA packet already in")
 				else:
-					if lora24GHz:
-						sensitivity = sensi[node.packet.sf - 5, [203.125,406.25,812.5,1625].index(node.packet.bw) + 1]
+					if packet.rssi < packet.sensitivity:
+						if print_sim:
+							print("node %s: DATA packet will be lost" % node.nodeid)
+						packet.lost = True
 					else:
-						sensitivity = sensi[node.packet.sf - 6, [125,250,500].index(node.packet.bw) + 1]
-					if node.packet.rssi < sensitivity:
-						print "node {}: DATA packet will be lost".format(node.nodeid)
-						node.packet.lost = True
-					else:
-						node.packet.lost = False
+						packet.lost = False
 						# adding packet if no collision
-						if (checkcollision(node.packet)==1):
-							node.packet.collided = 1
+						if (checkcollision(packet)==1):
+							packet.collided = 1
 						else:
-							node.packet.collided = 0
-						packetsAtBS.append(node)
-						node.packet.addTime = env.now
-
-				channel_busy_data=True
-				yield env.timeout(node.packet.rectime)
-				channel_busy_data=False
+							packet.collided = 0
+						addPacketAtBS(node)
+						packet.addTime = env.now
+						packet.endTime = env.now + packet.rectime
+
+				channel_busy|=channel_busy_data
+				yield timeout(packet.rectime)
+				channel_busy&=~channel_busy_data
 		
-				if node.packet.lost:
+				if packet.lost:
 					nrLost += 1
-				if node.packet.collided == 1:
+				if packet.collided == 1:
 					nrCollisions = nrCollisions + 1
-				if node.packet.collided == 0 and not node.packet.lost:
+				if packet.collided == 0 and not packet.lost:
 					nrReceived = nrReceived + 1
-					print "node {} {}: DATA packet has been correctly transmitted".format(node.nodeid, env.now)
-				if node.packet.processed == 1:
+					if print_sim:
+						print("node %s %s: DATA packet has been correctly transmitted" % (node.nodeid, env.now))
+				if packet.processed == 1:
 					nrProcessed = nrProcessed + 1
 			
 				# complete packet has been received by base station
 				# can remove it
-				if (node in packetsAtBS):
-					packetsAtBS.remove(node)
+				if (node in packetsAtBS_set):
+					removePacketAtBS(node)
 				# reset the packet
-				node.packet.collided = 0
-				node.packet.processed = 0
-				node.packet.lost = False
+				packet.collided = 0
+				packet.processed = 0
+				packet.lost = False
 				node.n_retry=n_retry
 				node.Wbusy_BE=Wbusy_BE
 
-		global targetSentPacket
-		#sent = sum(n.n_data_sent for n in nodes)
-		if nrProcessed > targetSentPacket:
-			global endSim
-			endSim=env.now
-			return
-		
-		global lastDisplayTime	
-		if nrProcessed % 10000 == 0 and env.now!=lastDisplayTime:
-			print >> sys.stderr, nrProcessed, "-",
-			lastDisplayTime=env.now	
+#
+# the settings read by transmit_node() do not change once the simulation is started
+# they are given as arguments so that the generator reads them as local variables instead of global look-ups
+def transmit(env,node):
+	return transmit_node(env, node, WL, W2, W3, Wnav, W2afterNAV, CA, CA1, CA2, experiment,
+		check_busy, check_busy_rts, Wbusy_min, Wbusy_BE, Wbusy_maxBE, Wbusy_exp_backoff,
+		n_retry, n_retry_rts, expoDistribType, uniformDistribType)
+
 #
 # "main" program
 #
 
+#--verbose can be given anywhere on the command line to turn on print_sim
+if '--verbose' in sys.argv:
+	sys.argv.remove('--verbose')
+	print_sim = True
+
 # get arguments
 if len(sys.argv) >= 6:
 	CA = bool(int(sys.argv[1]))
@@ -1641,23 +1860,23 @@ if len(sys.argv) >= 6:
 		if len(sys.argv) > 12:
 			P = int(sys.argv[12])				
 			
-	print "Nodes:", nrNodes
-	print "AvgSendTime:", avgSendTime
-	print "Distribution:", 'expoDistribType' if distribType==expoDistribType else 'uniformDistribType'
-	print "Experiment:", experiment
-	print "Simtime:", simtime
-	print "Full Collision:", full_collision
-	print "n_retry:", n_retry
-	print "check_busy:", check_busy
-	print "CCA_prob:", CCA_prob
-	print "Packet length:", packetLength  
-	print "max_payload_size:", max_payload_size
-	print "targetSentPacket:", targetSentPacket
-	print "Wbusy_min:", Wbusy_min
-	print "Wbusy_BE:", Wbusy_BE
-	print "Wbusy_maxBE:", Wbusy_maxBE
-	print "Wbusy_exp_backoff:", Wbusy_exp_backoff
-	print "Collision Avoidance:", CA
+	print("Nodes:", nrNodes)
+	print("AvgSendTime:", avgSendTime)
+	print("Distribution:", 'expoDistribType' if distribType==expoDistribType else 'uniformDistribType')
+	print("Experiment:", experiment)
+	print("Simtime:", simtime)
+	print("Full Collision:", full_collision)
+	print("n_retry:", n_retry)
+	print("check_busy:", check_busy)
+	print("CCA_prob:", CCA_prob)
+	print("Packet length:", packetLength)  
+	print("max_payload_size:", max_payload_size)
+	print("targetSentPacket:", targetSentPacket)
+	print("Wbusy_min:", Wbusy_min)
+	print("Wbusy_BE:", Wbusy_BE)
+	print("Wbusy_maxBE:", Wbusy_maxBE)
+	print("Wbusy_exp_backoff:", Wbusy_exp_backoff)
+	print("Collision Avoidance:", CA)
 
 	if CA1:
 		P=0
@@ -1668,19 +1887,19 @@ if len(sys.argv) >= 6:
 		#to keep the global amount of time for listening CA2_WL can be defined as 2*WL		
 		WL=CA2_WL
 	if CA:
-		print "P:", P
-		print "WL:", WL		
-		print "W2:", W2		
-		print "W3:", W3			
-		print "Wnav:", Wnav
-		print "W2afterNAV:", W2afterNAV			
-		print "n_retry_rts:", n_retry_rts
-		print "check_busy_rts:", check_busy_rts					
+		print("P:", P)
+		print("WL:", WL)		
+		print("W2:", W2)		
+		print("W3:", W3)			
+		print("Wnav:", Wnav)
+		print("W2afterNAV:", W2afterNAV)			
+		print("n_retry_rts:", n_retry_rts)
+		print("check_busy_rts:", check_busy_rts)					
 			
 else:
-	print "usage: ./loraDir_mac <ca=0> <nodes> <avgsend> <experiment> <simtime> [collision]"
-	print "usage: ./loraDir_mac <ca=1> <nodes> <avgsend> <experiment> <simtime> [collision] [WL] [W2] [W3] [Wnav] [W2afterNAV] [P]"	
-	print "experiment 0 and 1 use 1 frequency only"
+	print("usage: ./loraDir_mac <ca=0> <nodes> <avgsend> <experiment> <simtime> [collision]")
+	print("usage: ./loraDir_mac <ca=1> <nodes> <avgsend> <experiment> <simtime> [collision] [WL] [W2] [W3] [Wnav] [W2afterNAV] [P]")	
+	print("experiment 0 and 1 use 1 frequency only")
 	exit(-1)
 
 #raw_input('Press Enter to continue ...')
@@ -1690,7 +1909,18 @@ targetSentPacket = targetSentPacket * nrNodes
 # global stuff
 #Rnd = random.seed(12345)
 nodes = []
+#x and y positions of the nodes, in the same order than nodes
+nodes_x = np.empty(0)
+nodes_y = np.empty(0)
 packetsAtBS = []
+packetsAtBS_set = set()
+packetsAtBS_by_sf = {}
+packetsAtBS_processed = 0
+#nodes currently in start_phase1_listen or start_phase2_listen
+listening_nodes = set()
+#for each sender nodeid, the set of nodes marked to have received an RTS or a ValidHeader from it
+receive_rts_by_sender = {}
+receive_data_by_sender = {}
 env = simpy.Environment()
 
 # maximum number of packets the BS can receive at the same time
@@ -1719,7 +1949,6 @@ Lpld0 = 127.41
 GL = 0
 
 if lora24GHz:
-	sensi = np.array([sf5,sf6,sf7,sf8,sf9,sf10,sf11,sf12])
 	if experiment in [0,1,4,6,7]:
 		minsensi = sensi[7,2]	 # 7th row is SF12, 2nd column is BW203
 	elif experiment == 2:
@@ -1727,7 +1956,6 @@ if lora24GHz:
 	elif experiment in [3,5]:
 		minsensi = np.amin(sensi) ## Experiment 3 can use any setting, so take minimum
 else:
-	sensi = np.array([sf6,sf7,sf8,sf9,sf10,sf11,sf12])
 	if experiment in [0,1,4,6,7]:
 		minsensi = sensi[6,2]	 # 6th row is SF12, 2nd column is BW125
 	elif experiment == 2:
@@ -1736,9 +1964,9 @@ else:
 		minsensi = np.amin(sensi) ## Experiment 3 can use any setting, so take minimum
 	
 Lpl = Ptx - minsensi
-print "amin", minsensi, "Lpl", Lpl
+print("amin", minsensi, "Lpl", Lpl)
 maxDist = d0*(math.e**((Lpl-Lpld0)/(10.0*gamma)))
-print "maxDist:", maxDist
+print("maxDist:", maxDist)
 
 # base station placement
 bsx = maxDist+10
@@ -1747,7 +1975,9 @@ xmax = bsx + maxDist + 20
 ymax = bsy + maxDist + 20
 
 # prepare graphics and add sink
+# matplotlib is only imported when graphics are enabled, this saves startup time and memory for batch runs
 if (graphics == 1):
+	import matplotlib.pyplot as plt
 	plt.ion()
 	plt.figure()
 	ax = plt.gcf().gca()
@@ -1772,7 +2002,7 @@ for i in range(0,nrNodes):
 	node = myNode(i, endDeviceType, bsId, avgSendTime, distribType, packetLength)
 	nodes.append(node)
 	env.process(transmit(env,node))	
-	print "-----------------------------------------------------------------------------------------------"
+	print("-----------------------------------------------------------------------------------------------")
 	
 #prepare show
 if (graphics == 1):
@@ -1783,6 +2013,7 @@ if (graphics == 1):
 
 # start simulation
 env.run(until=simtime)
+flush_inter_transmit_time()
 
 # compute energy
 # Transmit consumption in mA from -2 to +17 dBm
@@ -1802,8 +2033,8 @@ sys.stdout=stdout_print_target
 #statistic per node
 #
 for node in nodes:
-	print "-- node {} ------------------------------------------------------------------".format(node.nodeid)
-	print "number of CAD:", node.n_cca
+	print("-- node {} ------------------------------------------------------------------".format(node.nodeid))
+	print("number of CAD:", node.n_cca)
 	#normally it is 2 and 4 symbols, but in reality it is closer to 3 and 5 symbols
 	nCadSym=3
 	if node.packet.sf > 8:
@@ -1814,209 +2045,209 @@ for node in nodes:
 	#consumption must be converted into mA: cad_consumption[node.packet.sf-7]/1e6	
 	energy = (node.packet.symTime * (cad_consumption[node.packet.sf-7]/1e6) * V * node.n_cca * nCadSym) / 1e6
 	node.cca_energy=energy
-	print "energy in CAD (in J):", energy									
-	energy = (node.data_rectime * TX[int(node.packet.txpow)+2] * V * node.n_data_sent \
-							+ node.rts_rectime * TX[int(node.packet.txpow)+2] * V * node.n_rts_sent) / 1e6
-	print "energy in transmission (in J):", energy
+	print("energy in CAD (in J):", energy)									
+	#txpow is fixed, the transmit consumption of the node is also kept for the totals
+	node.tx_mA=TX[int(node.packet.txpow)+2]
+	energy = (node.data_rectime * node.tx_mA * V * node.n_data_sent \
+							+ node.rts_rectime * node.tx_mA * V * node.n_rts_sent) / 1e6
+	print("energy in transmission (in J):", energy)
 	if CA:
 		energy = (node.total_listen_time * RX * V) / 1e6
-		print "energy in listening (in J):", energy
-	print "total energy (in J):", (node.data_rectime * TX[int(node.packet.txpow)+2] * V * node.n_data_sent \
-							+ node.rts_rectime * TX[int(node.packet.txpow)+2] * V * node.n_rts_sent \
-							+ node.total_listen_time * RX * V) / 1e6 + node.cca_energy
-	print "end of simulation time {}ms {}h".format(endSim, float(endSim/3600000))
-	print "cumulated time (s) in TX:", (node.data_rectime*node.n_data_sent+node.rts_rectime*node.n_rts_sent)/1000
+		print("energy in listening (in J):", energy)
+	print("total energy (in J):", (node.data_rectime * node.tx_mA * V * node.n_data_sent \
+							+ node.rts_rectime * node.tx_mA * V * node.n_rts_sent \
+							+ node.total_listen_time * RX * V) / 1e6 + node.cca_energy)
+	print("end of simulation time {}ms {}h".format(endSim, float(endSim/3600000)))
+	print("cumulated time (s) in TX:", (node.data_rectime*node.n_data_sent+node.rts_rectime*node.n_rts_sent)/1000)
 	if CA:
-		print "cumulated time (s) in RX:", node.total_listen_time/1000		
-	print "sent data packets:", node.n_data_sent	
-	print "mean latency:", node.latency/node.n_data_sent
-	print "aborted packets:", node.n_aborted
-	print "mean retry:", node.total_retry/node.n_data_sent
-	print "retry distribution:"
-	print node.retry_bin
-	print "retry sum:", sum(node.retry_bin)
-	for i in range(0,n_retry):
-		s = sum(node.retry_bin[0:i+1])
-		print "%.1f" % (s*100.0/sum(node.retry_bin)),
-	print ""		
-	print "channel busy DATA:", node.n_busy_data
+		print("cumulated time (s) in RX:", node.total_listen_time/1000)		
+	print("sent data packets:", node.n_data_sent)	
+	print("mean latency:", node.latency/node.n_data_sent)
+	print("aborted packets:", node.n_aborted)
+	print("mean retry:", node.total_retry/node.n_data_sent)
+	print("retry distribution:")
+	print(node.retry_bin.tolist())
+	retry_sum = node.retry_bin.sum()
+	print("retry sum:", retry_sum)
+	#cumulative distribution in %
+	cdf = np.cumsum(node.retry_bin)*100.0/retry_sum
+	print(" ".join("%.1f" % v for v in cdf), end=' ')
+	print("")		
+	print("channel busy DATA:", node.n_busy_data)
 	if CA:
-		print "channel busy RTS:", node.n_busy_rts
-		print "channel busy RTS (P1):", node.n_busy_rts_p1		
-		print "sent rts packets:", node.n_rts_sent	
-		print "NAV from RTS P1:", node.n_receive_nav_rts_p1
-		print "NAV from RTS P2:", node.n_receive_nav_rts_p2
-		print "NAV from RTS ++:", node.n_receive_nav_rts_p1+node.n_receive_nav_rts_p2		
-		print "NAV from DATA P1:", node.n_receive_nav_data_p1	
-		print "NAV from DATA P2:", node.n_receive_nav_data_p2
-		print "NAV from DATA ++:", node.n_receive_nav_data_p1+node.n_receive_nav_data_p2	
-		print "RTS retry distribution:"
-		print node.retry_rts_bin
-		print "rts retry sum:", sum(node.retry_rts_bin)
-		for i in range(0,n_retry_rts):
-			s = sum(node.retry_rts_bin[0:i+1])
-			print "%.1f" % (s*100.0/sum(node.retry_rts_bin)),
-		print ""
+		print("channel busy RTS:", node.n_busy_rts)
+		print("channel busy RTS (P1):", node.n_busy_rts_p1)		
+		print("sent rts packets:", node.n_rts_sent)	
+		print("NAV from RTS P1:", node.n_receive_nav_rts_p1)
+		print("NAV from RTS P2:", node.n_receive_nav_rts_p2)
+		print("NAV from RTS ++:", node.n_receive_nav_rts_p1+node.n_receive_nav_rts_p2)		
+		print("NAV from DATA P1:", node.n_receive_nav_data_p1)	
+		print("NAV from DATA P2:", node.n_receive_nav_data_p2)
+		print("NAV from DATA ++:", node.n_receive_nav_data_p1+node.n_receive_nav_data_p2)	
+		print("RTS retry distribution:")
+		print(node.retry_rts_bin.tolist())
+		retry_rts_sum = node.retry_rts_bin.sum()
+		print("rts retry sum:", retry_rts_sum)
+		cdf = np.cumsum(node.retry_rts_bin[0:n_retry_rts])*100.0/retry_rts_sum
+		print(" ".join("%.1f" % v for v in cdf), end=' ')
+		print("")
+
+#totals for the whole system, computed once for the terminal and the file outputs below
+#the sums keep the per node expressions and the node order so that the printed values do not change
+tx_energy = sum( n.data_rectime * n.tx_mA * V * n.n_data_sent \
+							+ n.rts_rectime * n.tx_mA * V * n.n_rts_sent for n in nodes) / 1e6
+listen_energy = sum( n.total_listen_time * RX * V for n in nodes) / 1e6
+cca_energy = sum( n.cca_energy for n in nodes)
+total_energy = sum( n.data_rectime * n.tx_mA * V * n.n_data_sent \
+							+ n.rts_rectime * n.tx_mA * V * n.n_rts_sent \
+							+ n.total_listen_time * RX * V for n in nodes) / 1e6 + cca_energy
+tx_time = sum( (n.data_rectime*n.n_data_sent+n.rts_rectime*n.n_rts_sent) for n in nodes)
+listen_time = sum( (n.total_listen_time) for n in nodes)
+sent = sum(n.n_data_sent for n in nodes)
+rts_sent = sum(n.n_rts_sent for n in nodes)
+n_receive_nav_data_p1 = sum(n.n_receive_nav_data_p1 for n in nodes)
+n_receive_nav_data_p2 = sum(n.n_receive_nav_data_p2 for n in nodes)	
+n_receive_nav_rts_p1 = sum(n.n_receive_nav_rts_p1 for n in nodes)
+n_receive_nav_rts_p2 = sum(n.n_receive_nav_rts_p2 for n in nodes)
+#retry distributions of all the nodes, one row per node
+retry_bin = np.stack([n.retry_bin for n in nodes]).sum(axis=0)
+retry_rts_bin = np.stack([n.retry_rts_bin for n in nodes]).sum(axis=0)
 			
 for i in range(0,2):
 	if i==1:
 		fname = "exp" + str(experiment) + ".dat"
-		f=open(fname, 'a')
-		# Change the standard output to the file we created
-		sys.stdout = f 
+		# Change the standard output to a buffer that is appended to the file in a single write at the end
+		# so that the results of simulations running in parallel are not interleaved in the file
+		sys.stdout = StringIO()
 	
-	print "-- SETTINGS -----------------------------------------------------------------"
-
-	print "Nodes:", nrNodes
-	print "AvgSendTime:", avgSendTime
-	print "Distribution:", 'expoDistribType' if distribType==expoDistribType else 'uniformDistribType'
-	print "Experiment:", experiment
-	print "Simtime:", simtime
-	print "Full Collision:", full_collision
-	print "Toa DATA:", nodes[0].data_rectime
-	print "Toa RTS:", nodes[0].rts_rectime	
-	print "DIFS:", nodes[0].packet.Tpream	
-	print "n_retry:", n_retry
-	print "check_busy:", check_busy
-	print "CCA_prob:", CCA_prob
-	print "Packet length:", packetLength  
-	print "targetSentPacket:", targetSentPacket
-	print "Wbusy_min:", Wbusy_min
-	print "Wbusy_BE:", Wbusy_BE
-	print "Wbusy_maxBE:", Wbusy_maxBE
-	print "Wbusy_exp_backoff:", Wbusy_exp_backoff
-	print "Collision Avoidance:", CA
+	print("-- SETTINGS -----------------------------------------------------------------")
+
+	print("Nodes:", nrNodes)
+	print("AvgSendTime:", avgSendTime)
+	print("Distribution:", 'expoDistribType' if distribType==expoDistribType else 'uniformDistribType')
+	print("Experiment:", experiment)
+	print("Simtime:", simtime)
+	print("Full Collision:", full_collision)
+	print("Toa DATA:", nodes[0].data_rectime)
+	print("Toa RTS:", nodes[0].rts_rectime)	
+	print("DIFS:", nodes[0].packet.Tpream)	
+	print("n_retry:", n_retry)
+	print("check_busy:", check_busy)
+	print("CCA_prob:", CCA_prob)
+	print("Packet length:", packetLength)  
+	print("targetSentPacket:", targetSentPacket)
+	print("Wbusy_min:", Wbusy_min)
+	print("Wbusy_BE:", Wbusy_BE)
+	print("Wbusy_maxBE:", Wbusy_maxBE)
+	print("Wbusy_exp_backoff:", Wbusy_exp_backoff)
+	print("Collision Avoidance:", CA)
 	if CA:
-		print "P:", P
-		print "WL:", WL		
-		print "W2:", W2		
-		print "W3:", W3			
-		print "Wnav:", Wnav
-		print "W2afterNAV:", W2afterNAV			
-		print "n_retry_rts:", n_retry_rts
-		print "check_busy_rts:", check_busy_rts			
+		print("P:", P)
+		print("WL:", WL)		
+		print("W2:", W2)		
+		print("W3:", W3)			
+		print("Wnav:", Wnav)
+		print("W2afterNAV:", W2afterNAV)			
+		print("n_retry_rts:", n_retry_rts)
+		print("check_busy_rts:", check_busy_rts)			
     	
-	print "-- TOTAL --------------------------------------------------------------------"
+	print("-- TOTAL --------------------------------------------------------------------")
 	
-	sent = sum(n.n_data_sent for n in nodes)
-	rts_sent = sum(n.n_rts_sent for n in nodes)
-	n_receive_nav_data_p1 = sum(n.n_receive_nav_data_p1 for n in nodes)
-	n_receive_nav_data_p2 = sum(n.n_receive_nav_data_p2 for n in nodes)	
-	n_receive_nav_rts_p1 = sum(n.n_receive_nav_rts_p1 for n in nodes)
-	n_receive_nav_rts_p2 = sum(n.n_receive_nav_rts_p2 for n in nodes)	
-	energy = sum( n.data_rectime * TX[int(n.packet.txpow)+2] * V * n.n_data_sent \
-								+ n.rts_rectime * TX[int(n.packet.txpow)+2] * V * n.n_rts_sent for n in nodes) / 1e6
-	print "energy in CAD (in J):", sum( n.cca_energy	for n in nodes)						
-	print "energy in transmission (in J):", energy
-	energy = sum( n.total_listen_time * RX * V for n in nodes) / 1e6
-	print "energy in listening (in J):", energy
-	print "total energy (in J):", sum( n.data_rectime * TX[int(n.packet.txpow)+2] * V * n.n_data_sent \
-								+ n.rts_rectime * TX[int(n.packet.txpow)+2] * V * n.n_rts_sent \
-								+ n.total_listen_time * RX * V for n in nodes) / 1e6 + sum( n.cca_energy for n in nodes)
-	print "end of simulation time {}ms {}h".format(endSim, float(endSim/3600000))							
-	print "cumulated time (s) in TX:", sum( (n.data_rectime*n.n_data_sent+n.rts_rectime*n.n_rts_sent) for n in nodes)/1000
+	print("energy in CAD (in J):", cca_energy)						
+	print("energy in transmission (in J):", tx_energy)
+	print("energy in listening (in J):", listen_energy)
+	print("total energy (in J):", total_energy)
+	print("end of simulation time {}ms {}h".format(endSim, float(endSim/3600000)))							
+	print("cumulated time (s) in TX:", tx_time/1000)
 	if CA:
-		print "cumulated time (s) in RX:", sum( (n.total_listen_time) for n in nodes)/1000
-	print "number of CCA:", sum (n.n_cca for n in nodes)			
-	print "sent data packets:", sent
-	print "mean latency:", sum (float(n.latency)/float(n.n_data_sent) for n in nodes) / nrNodes
-	print "aborted packets:", sum (n.n_aborted for n in nodes)
-	print "collisions:", nrCollisions
-	print "received packets:", nrReceived
-	print "processed packets:", nrProcessed
-	print "lost packets:", nrLost
-
-	retry_bin = []
-
-	print "retry distribution:"
+		print("cumulated time (s) in RX:", listen_time/1000)
+	print("number of CCA:", sum (n.n_cca for n in nodes))			
+	print("sent data packets:", sent)
+	print("mean latency:", sum (float(n.latency)/float(n.n_data_sent) for n in nodes) / nrNodes)
+	print("aborted packets:", sum (n.n_aborted for n in nodes))
+	print("collisions:", nrCollisions)
+	print("received packets:", nrReceived)
+	print("processed packets:", nrProcessed)
+	print("lost packets:", nrLost)
+
+	print("retry distribution:")
 		
 	for node in nodes:
-		print node.retry_bin
-
-	for i in range(0,n_retry):
-		s = 0
-		for node in nodes:
-			s = s + node.retry_bin[i]
-		retry_bin.append(s)
+		print(node.retry_bin.tolist())
 
-	print "mean retry:", sum((float(n.total_retry)/float(n.n_data_sent)) for n in nodes)/nrNodes
+	print("mean retry:", sum((float(n.total_retry)/float(n.n_data_sent)) for n in nodes)/nrNodes)
 
-	print retry_bin
+	print(retry_bin.tolist())
 	
-	for i in range(0,n_retry):			
-		s = sum(retry_bin[0:i+1])
-		print "%.1f" % (s*100.0/sent),
-		if s==sent:
-			break
-	print ""	
+	#cumulative distribution in %, up to the first number of retries that covers all the sent packets
+	cdf = np.cumsum(retry_bin)
+	last = np.flatnonzero(cdf==sent)
+	cdf = cdf[0:last[0]+1] if last.size else cdf
+	print(" ".join("%.1f" % (s*100.0/sent) for s in cdf), end=' ')
+	print("")	
 	
-	print "channel busy DATA:", sum (n.n_busy_data for n in nodes)
+	print("channel busy DATA:", sum (n.n_busy_data for n in nodes))
 	if CA:
-		print "channel busy RTS:", sum (n.n_busy_rts for n in nodes)
-		print "channel busy RTS (P1):", sum (n.n_busy_rts_p1 for n in nodes)		
-		print "sent rts packets:", rts_sent	
-		print "RTS collisions:", nrRTSCollisions
-		print "RTS received packets:", nrRTSReceived
-		print "RTS processed packets:", nrRTSProcessed
-		print "RTS lost packets:", nrRTSLost
-		print "NAV from RTS P1:", n_receive_nav_rts_p1
-		print "NAV from RTS P2:", n_receive_nav_rts_p2
-		print "NAV from RTS ++:", n_receive_nav_rts_p1+n_receive_nav_rts_p2		
-		print "NAV from DATA P1:", n_receive_nav_data_p1	
-		print "NAV from DATA P2:", n_receive_nav_data_p2
-		print "NAV from DATA ++:", n_receive_nav_data_p1+n_receive_nav_data_p2	
-
-		retry_rts_bin = []
-
-		print "RTS retry distribution:"
+		print("channel busy RTS:", sum (n.n_busy_rts for n in nodes))
+		print("channel busy RTS (P1):", sum (n.n_busy_rts_p1 for n in nodes))		
+		print("sent rts packets:", rts_sent)	
+		print("RTS collisions:", nrRTSCollisions)
+		print("RTS received packets:", nrRTSReceived)
+		print("RTS processed packets:", nrRTSProcessed)
+		print("RTS lost packets:", nrRTSLost)
+		print("NAV from RTS P1:", n_receive_nav_rts_p1)
+		print("NAV from RTS P2:", n_receive_nav_rts_p2)
+		print("NAV from RTS ++:", n_receive_nav_rts_p1+n_receive_nav_rts_p2)		
+		print("NAV from DATA P1:", n_receive_nav_data_p1)	
+		print("NAV from DATA P2:", n_receive_nav_data_p2)
+		print("NAV from DATA ++:", n_receive_nav_data_p1+n_receive_nav_data_p2)	
+
+		print("RTS retry distribution:")
 		
 		for node in nodes:
-			print node.retry_rts_bin
-
-		for i in range(0,n_retry_rts+1):
-			s = 0
-			for node in nodes:
-				s = s + node.retry_rts_bin[i]
-			retry_rts_bin.append(s)
+			print(node.retry_rts_bin.tolist())
 
-		print "mean RTS retry:", sum((float(n.total_retry_rts)/float(n.n_rts_sent)) for n in nodes)/nrNodes
+		print("mean RTS retry:", sum((float(n.total_retry_rts)/float(n.n_rts_sent)) for n in nodes)/nrNodes)
 
-		print retry_rts_bin
+		print(retry_rts_bin.tolist())
 	
-		for i in range(0,n_retry_rts+1):			
-			s = sum(retry_rts_bin[0:i+1])
-			print "%.1f" % (s*100.0/rts_sent),
-			if s==rts_sent:
-				break
-		print ""			
+		cdf = np.cumsum(retry_rts_bin)
+		last = np.flatnonzero(cdf==rts_sent)
+		cdf = cdf[0:last[0]+1] if last.size else cdf
+		print(" ".join("%.1f" % (s*100.0/rts_sent) for s in cdf), end=' ')
+		print("")			
 
 	if sent>0:
 		# data extraction rate
 		der = (sent-nrCollisions)/float(sent)
-		print "DER:", der
+		print("DER:", der)
 		der = (nrReceived)/float(sent)
-		print "DER method 2:", der
+		print("DER method 2:", der)
 	
-	print "n_transmit:", n_transmit	
-	print "mean inter-transmit time (ms):", inter_transmit_time/float(n_transmit)
-	print "inter-transmit time distribution [<1s, <2s, <3s, <4s, ...]:"
-	print inter_transmit_time_bin
+	print("n_transmit:", n_transmit)	
+	print("mean inter-transmit time (ms):", inter_transmit_time/float(n_transmit))
+	print("inter-transmit time distribution [<1s, <2s, <3s, <4s, ...]:")
+	print(inter_transmit_time_bin.tolist())
 	
-print "-- END ----------------------------------------------------------------------"	
+print("-- END ----------------------------------------------------------------------")	
+
+with open(fname, 'a') as f:
+	f.write(sys.stdout.getvalue())
+sys.stdout=stdout_print_target
 
 """	
 # this can be done to keep graphics visible
 if (graphics == 1):
-	raw_input('Press Enter to continue ...')
+	input('Press Enter to continue ...')
 
 # save experiment data into a dat file that can be read by e.g. gnuplot
 # name of file would be:	exp0.dat for experiment 0
 fname = "exp" + str(experiment) + ".dat"
-print fname
+print(fname)
 if os.path.isfile(fname):
-	res = "\n" + str(nrNodes) + " " + str(nrCollisions) + " "	 + str(sent) + " " + str(energy)
+	res = "\n" + str(nrNodes) + " " + str(nrCollisions) + " "	 + str(sent) + " " + str(listen_energy)
 else:
-	res = "#nrNodes nrCollisions nrTransmissions OverallEnergy\n" + str(nrNodes) + " " + str(nrCollisions) + " "	+ str(sent) + " " + str(energy)
+	res = "#nrNodes nrCollisions nrTransmissions OverallEnergy\n" + str(nrNodes) + " " + str(nrCollisions) + " "	+ str(sent) + " " + str(listen_energy)
 with open(fname, "a") as myfile:
 	myfile.write(res)
 myfile.close()